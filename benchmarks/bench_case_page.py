@@ -0,0 +1,73 @@
+import argparse
+import random
+import time
+
+import mwparserfromhell
+
+from cci.fetch_cci import _parse_case_page, _parse_line, _parse_line_tree, _parse_page
+
+
+def _make_case_page(name: str, num_lines: int, section_lines: int, rng: random.Random) -> str:
+    lines = ['{{CCI}}', '== Background ==', 'Synthetic case for benchmarking.', f'== {name} ==']
+    revid = 100_000
+    for i in range(num_lines):
+        if i % section_lines == 0:
+            lines.append(f'=== Pages {i + 1} through {i + section_lines} ===')
+        diffs = ''
+        for _ in range(rng.randint(1, 6)):
+            revid += rng.randint(1, 1000)
+            diffs += f'[[Special:Diff/{revid}|({rng.choice("+-")}{rng.randint(0, 20000)})]]'
+        count = rng.randint(1, 100)
+        new = "'''N''' " if rng.random() < 0.2 else ''
+        line = f"*{new}[[:Page {i} (O'moth)]] ({count} edit{'s' if count > 1 else ''}): {diffs}"
+        # Some lines have been reviewed or commented on, and need the full parser
+        roll = rng.random()
+        if roll < 0.02:
+            line = line.replace('*', '*{{y}} ', 1)
+        elif roll < 0.03:
+            line += ' <small>checked the first one</small>'
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def _measure(name: str, func, repeat: int):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f'{name:>12}: {elapsed * 1000:10.1f} ms')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark parsing a case page.')
+    parser.add_argument('-n', '--lines', type=int, default=100_000)
+    parser.add_argument('--section-lines', type=int, default=1000)
+    parser.add_argument('--tree-lines', type=int, default=10_000,
+                        help='Lines to also parse with the full parser alone, as it is slow')
+    parser.add_argument('-r', '--repeat', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    content = _make_case_page('Example', args.lines, args.section_lines, rng)
+    print(f'{args.lines} lines, {len(content) >> 10} KiB')
+    print('whole page parsed:')
+    tree = _measure('parse', lambda: mwparserfromhell.parse(content), args.repeat)
+    full = _measure('case page', lambda: _parse_case_page('1', 'Example', tree), args.repeat)
+    print('report lines left out:')
+    tree, runs = _measure('parse', lambda: _parse_page(content), args.repeat)
+    casepage = _measure(
+        'case page', lambda: _parse_case_page('1', 'Example', tree, runs), args.repeat)
+    assert casepage == full, 'leaving out report lines changed the case page'
+    print(f'{sum(len(section.pages) for section in casepage.sections.values())} pages, '
+          f'{sum(map(len, runs))} report lines left out')
+
+    lines = [line for line in content.splitlines() if line.startswith('*')][:args.tree_lines]
+    print(f'{len(lines)} lines alone:')
+    fast = _measure('fast path', lambda: [_parse_line(line) for line in lines], args.repeat)
+    full = _measure('parser', lambda: [_parse_line_tree(line) for line in lines], args.repeat)
+    assert fast == full, 'the fast path and the parser disagree'
+
+
+if __name__ == '__main__':
+    main()
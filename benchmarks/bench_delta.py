@@ -0,0 +1,66 @@
+import argparse
+import random
+import string
+import time
+import tracemalloc
+
+from cci.delta import added_lines
+
+
+def _old_added_lines(before: str, after: str):
+    lines = set(before.splitlines())
+    return [
+        (i, line) for i, line in enumerate(after.splitlines(), 1)
+        if line.strip() and line not in lines
+    ]
+
+
+def _make_article(num_lines: int, rng: random.Random) -> str:
+    words = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 10)))
+             for _ in range(5000)]
+    return '\n'.join(' '.join(rng.choices(words, k=rng.randint(0, 40)))
+                     for _ in range(num_lines))
+
+
+def _edit(text: str, rng: random.Random) -> str:
+    lines = text.splitlines()
+    for _ in range(len(lines) // 100):
+        i = rng.randrange(len(lines))
+        lines.insert(rng.randrange(len(lines)), lines.pop(i))
+        lines.insert(i, 'added line %d' % rng.randrange(1 << 30))
+    return '\n'.join(lines)
+
+
+def _measure(name: str, func, before: str, after: str, repeat: int):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func(before, after)
+    elapsed = (time.perf_counter() - start) / repeat
+    # Measured separately, since tracing allocations skews the timing
+    tracemalloc.start()
+    func(before, after)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{name:>10}: {elapsed * 1000:8.2f} ms  peak {peak / 1024:8.0f} KiB  '
+          f'{len(result)} lines added')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark line delta computation.')
+    parser.add_argument('-n', '--lines', type=int, nargs='+', default=[10_000, 50_000])
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    for num_lines in args.lines:
+        before = _make_article(num_lines, rng)
+        after = _edit(before, rng)
+        print(f'{num_lines} lines, {len(before) >> 10} KiB')
+        _measure('strings', _old_added_lines, before, after, args.repeat)
+        _measure('hashed', added_lines, before, after, args.repeat)
+        _measure('multiset', lambda b, a: added_lines(b, a, multiset=True),
+                 before, after, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
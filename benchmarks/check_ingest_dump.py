@@ -0,0 +1,130 @@
+import argparse
+import bz2
+import os
+from pathlib import Path
+import shutil
+import subprocess
+import sys
+import tempfile
+from typing import List, TextIO
+from xml.sax.saxutils import escape
+
+from cci.casestore import load_case
+from cci.revstore import open_store
+
+from .fakeapi import FakeWiki, serve
+from .synth import SynthParams, generate
+
+_REPO = Path(__file__).resolve().parent.parent
+
+
+def _run(env: dict, *args: str):
+    proc = subprocess.run([sys.executable, '-m', *args], cwd=_REPO, env=env,
+                          capture_output=True, text=True)
+    if proc.returncode:
+        sys.exit(f'{args[0]} failed:\n{proc.stderr[-2000:]}')
+
+
+def _write_dump(fp: TextIO, wiki: FakeWiki, titles: List[str], parentids: bool):
+    # Dumps from before MediaWiki 1.21 have no parentids
+    fp.write('<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.10/" version="0.10">\n'
+             '<siteinfo><sitename>Wikipedia</sitename></siteinfo>\n')
+    for title in titles:
+        fp.write(f'<page><title>{escape(title)}</title><ns>0</ns>'
+                 f'<id>{wiki.pageids[title]}</id>\n')
+        for rev in wiki.pages[title]:
+            fp.write(f"<revision><id>{rev['revid']}</id>")
+            if parentids and rev['parentid']:
+                fp.write(f"<parentid>{rev['parentid']}</parentid>")
+            fp.write('<timestamp>2020-01-01T00:00:00Z</timestamp>')
+            if rev.get('hidden'):
+                fp.write('<text deleted="deleted" />')
+            else:
+                fp.write(f"<text xml:space=\"preserve\">{escape(rev['content'])}</text>")
+            fp.write('</revision>\n')
+        fp.write('</page>\n')
+    fp.write('</mediawiki>\n')
+
+
+def check(work_dir: Path):
+    # Stores a small case's revisions from a dump and checks they match what fetch_diffs stores
+    # from the API. The dump is split in two: a plain file with parentids, and a .bz2 one in
+    # the older format without them.
+    wiki = FakeWiki()
+    generate(SynthParams(case_pages=1, sections=2, pages=4, diffs=2, missing=0), wiki)
+    server = serve(wiki)
+    env = dict(
+        os.environ,
+        CCI_API_URL=f'http://127.0.0.1:{server.server_address[1]}/',
+        CCI_CACHE_DIR=str(work_dir / 'cache'),
+        PYTHONPATH=str(_REPO),
+    )
+    api, dump = work_dir / 'api', work_dir / 'dump'
+    try:
+        _run(env, 'cci.fetch_cci', 'Synthetic', '-o', str(api))
+        shutil.copytree(api, dump)
+
+        case = load_case(api)
+        listed = {diff.revid for *_, diff in case.iter_diffs()}
+        articles = list(dict.fromkeys(page.title for *_, page, _ in case.iter_diffs()))
+        # Hidden text, on a listed revision and on the unlisted parent of another
+        hidden_listed = articles[0]
+        wiki.pages[hidden_listed][-1]['hidden'] = True
+        hidden_parent = next(
+            (title, rev) for title in articles[1:]
+            for rev, child in zip(wiki.pages[title], wiki.pages[title][1:])
+            if rev['revid'] not in listed and child['revid'] in listed
+        )
+        hidden_parent[1]['hidden'] = True
+        # A deleted listed revision, on a page that's still there, and a deleted page
+        rest = [title for title in articles[1:] if title != hidden_parent[0]]
+        deleted_from = next(title for title in rest if wiki.pages[title][-1]['revid'] in listed)
+        del wiki.revs[wiki.pages[deleted_from].pop()['revid']]
+        deleted = next(title for title in rest if title != deleted_from)
+        for rev in wiki.pages.pop(deleted):
+            del wiki.revs[rev['revid']]
+
+        _run(env, 'cci.fetch_diffs', str(api), '--no-revision-cache')
+    finally:
+        server.shutdown()
+
+    titles = sorted(wiki.pages)
+    first, second = titles[:len(titles) // 2], titles[len(titles) // 2:]
+    with (work_dir / 'part1.xml').open('w') as fp:
+        _write_dump(fp, wiki, first, parentids=True)
+    with bz2.open(work_dir / 'part2.xml.bz2', 'wt') as fp:
+        _write_dump(fp, wiki, second, parentids=False)
+
+    # Given only part of the dump, nothing can be marked missing
+    _run(env, 'cci.ingest_dump', str(dump), str(work_dir / 'part1.xml'), '--partial',
+         '--no-revision-cache')
+    with open_store(dump) as store:
+        stored = {revid: store.get(revid) for revid in store}
+    if any('missing' in rev and rev['missing'] != 'content' for rev in stored.values()):
+        sys.exit('ingest_dump --partial marked revisions missing')
+    if any(rev['title'] not in first for rev in stored.values()):
+        sys.exit('ingest_dump --partial stored revisions from outside the dump')
+
+    _run(env, 'cci.ingest_dump', str(dump), str(work_dir / 'part1.xml'),
+         str(work_dir / 'part2.xml.bz2'), '--no-revision-cache')
+    with open_store(api) as expected_store, open_store(dump) as store:
+        expected = {revid: expected_store.get(revid) for revid in expected_store}
+        stored = {revid: store.get(revid) for revid in store}
+    if stored != expected:
+        differing = sorted(revid for revid in expected.keys() | stored.keys()
+                           if stored.get(revid) != expected.get(revid))
+        sys.exit(f'ingest_dump and fetch_diffs stored different revisions: {differing}')
+    missing = sorted(rev['missing'] for rev in stored.values() if 'missing' in rev)
+    print(f'{len(stored)} revisions match fetch_diffs, missing: {", ".join(missing)}')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Check that ingest_dump stores the same revisions as fetch_diffs.')
+    parser.parse_args()
+    with tempfile.TemporaryDirectory() as work_dir:
+        check(Path(work_dir))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+import argparse
+import contextlib
+import gzip
+import json
+import os
+from pathlib import Path
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+from typing import Iterator
+
+from cci.casestore import load_case
+from cci.editstore import count_edits
+from cci.revstore import open_store
+
+from .fakeapi import FakeWiki, serve
+from .synth import SynthParams, generate
+
+_REPO = Path(__file__).resolve().parent.parent
+
+
+def _run(env: dict, *args: str) -> str:
+    proc = subprocess.run([sys.executable, '-m', *args], cwd=_REPO, env=env,
+                          capture_output=True, text=True)
+    if proc.returncode:
+        sys.exit(f'{args[0]} failed:\n{proc.stderr[-2000:]}')
+    return proc.stderr
+
+
+@contextlib.contextmanager
+def _wiki(work_dir: Path) -> Iterator[tuple]:
+    wiki = FakeWiki()
+    generate(SynthParams(pages=30, diffs=4), wiki)
+    server = serve(wiki)
+    env = dict(
+        os.environ,
+        CCI_API_URL=f'http://127.0.0.1:{server.server_address[1]}/',
+        CCI_CACHE_DIR=str(work_dir / 'cache'),
+        PYTHONPATH=str(_REPO),
+    )
+    try:
+        yield wiki, env
+    finally:
+        server.shutdown()
+
+
+def check_moved_page(work_dir: Path):
+    # Two cases share the revision cache, and a page moves between fetching them: the second
+    # case gets a listed revision under the new title and its parent from the cache, which was
+    # filled under the old one. build_edits has to cope with that.
+    with _wiki(work_dir) as (wiki, env):
+        first, second = work_dir / 'first', work_dir / 'second'
+        _run(env, 'cci.fetch_cci', 'Synthetic', '-o', str(first))
+        _run(env, 'cci.fetch_cci', 'Synthetic', '-o', str(second))
+        _run(env, 'cci.fetch_diffs', str(first))
+
+        case = load_case(first)
+        listed = {diff.revid for *_, diff in case.iter_diffs()}
+        with open_store(first) as store:
+            page, diff = next(
+                (page, diff) for *_, page, diff in case.iter_diffs()
+                if store.get(diff.revid).get('parentid', 0) not in listed | {0}
+            )
+        wiki.add_page(page.title + ' (moth)', wiki.pages.pop(page.title))
+        conn = sqlite3.connect(work_dir / 'cache' / 'revisions.db')
+        with conn:
+            conn.execute('DELETE FROM revs WHERE revid = ?', (diff.revid,))
+        conn.close()
+
+        _run(env, 'cci.fetch_diffs', str(second))
+        _run(env, 'cci.build_edits', str(second))
+    print(f'moved {page.title!r}; build_edits OK')
+
+
+def check_cache_only_revisions(work_dir: Path):
+    # Revisions build_edits only finds in the revision cache still have to be readable when
+    # the edits refer to them by id, as cull_diffs reads them from the case alone
+    with _wiki(work_dir) as (wiki, env):
+        root = work_dir / 'case'
+        _run(env, 'cci.fetch_cci', 'Synthetic', '-o', str(root))
+        _run(env, 'cci.fetch_diffs', str(root))
+    conn = sqlite3.connect(root / 'revs.db')
+    conn.execute('ATTACH ? AS cache', (str(work_dir / 'cache' / 'revisions.db'),))
+    with conn:
+        removed = conn.execute(
+            'DELETE FROM main.revs WHERE revid % 2 AND revid IN (SELECT revid FROM cache.revs)'
+        ).rowcount
+    conn.close()
+
+    shutil.copy(_REPO / 'moths' / 'rules.yaml', root / 'rules.yaml')
+    _run(env, 'cci.build_edits', str(root))
+    log = _run(env, 'cci.cull_diffs', str(root), '-b', '1', '-a', '--no-cache',
+               '--no-preprocess-cache')
+    if 'Failed to cull edit' in log:
+        sys.exit(f'cull_diffs failed to read revisions removed from the case:\n{log[-2000:]}')
+    num_culled = 0
+    for path in (root / 'cull' / 'batch-01').glob('*.json.gz'):
+        with gzip.open(path, 'rt') as fp:
+            num_culled += len(json.load(fp))
+    num_edits = count_edits(root / 'edits.jsonl.gz')
+    if num_culled != num_edits:
+        sys.exit(f'cull_diffs wrote {num_culled} of {num_edits} edits')
+    print(f'removed {removed} revisions from the case; all {num_edits} edits culled')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Check that cases sharing the revision cache build and cull correctly.')
+    parser.parse_args()
+    for check in [check_moved_page, check_cache_only_revisions]:
+        with tempfile.TemporaryDirectory() as work_dir:
+            check(Path(work_dir))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+from typing import Dict, List, Optional, Tuple
+import urllib.parse
+
+class FakeWiki:
+    # Just enough of the MediaWiki query API (formatversion 2) for the cci tools
+    def __init__(self):
+        self.pages: Dict[str, List[dict]] = {}
+        self.revs: Dict[int, Tuple[str, dict]] = {}
+        self.pageids: Dict[str, int] = {}
+        self.num_requests = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+
+    def add_page(self, title: str, revs: List[dict]):
+        # revs are dicts with revid, parentid and content (or hidden), oldest first
+        self.pages[title] = revs
+        self.pageids.setdefault(title, len(self.pageids) + 1)
+        for rev in revs:
+            self.revs[rev['revid']] = (title, rev)
+
+    def reset_stats(self):
+        with self._lock:
+            self.num_requests = 0
+            self.bytes_sent = 0
+
+    def handle(self, params: Dict[str, str]) -> bytes:
+        body = json.dumps(self.query(params)).encode()
+        with self._lock:
+            self.num_requests += 1
+            self.bytes_sent += len(body)
+        return body
+
+    def query(self, params: Dict[str, str]) -> dict:
+        if params.get('action') != 'query':
+            return {'error': {'code': 'badvalue', 'info': 'Only action=query is supported'}}
+        props = set(params.get('rvprop', 'ids').split('|'))
+        result: dict = {'batchcomplete': True, 'query': {}}
+        if 'revids' in params:
+            result['query'] = self._query_revids(params['revids'].split('|'), props)
+        elif 'titles' in params:
+            pages, cont = self._query_titles(params['titles'].split('|'), params, props)
+            result['query']['pages'] = pages
+            if cont:
+                del result['batchcomplete']
+                result['continue'] = {'rvcontinue': str(cont), 'continue': '||'}
+        return result
+
+    def _query_revids(self, revids: List[str], props: set) -> dict:
+        pages: Dict[str, dict] = {}
+        bad = {}
+        for revid in map(int, revids):
+            if revid not in self.revs:
+                bad[str(revid)] = {'revid': revid, 'missing': True}
+                continue
+            title, rev = self.revs[revid]
+            page = pages.setdefault(title, self._page(title))
+            page.setdefault('revisions', []).append(_format_rev(rev, props))
+        result: dict = {'pages': list(pages.values())}
+        if bad:
+            result['badrevids'] = bad
+        return result
+
+    def _query_titles(
+        self, titles: List[str], params: Dict[str, str], props: set,
+    ) -> Tuple[List[dict], Optional[int]]:
+        pages = []
+        cont = None
+        for title in titles:
+            if title not in self.pages:
+                pages.append({'ns': 0, 'title': title, 'missing': True})
+                continue
+            page = self._page(title)
+            revs = self.pages[title]
+            if params.get('prop') == 'info':
+                page['lastrevid'] = revs[-1]['revid']
+                page['length'] = len(revs[-1].get('content', ''))
+            elif params.get('prop') == 'revisions':
+                selected, cont = _select_revs(revs, params, 'content' in props)
+                if selected:
+                    page['revisions'] = [_format_rev(rev, props) for rev in selected]
+            pages.append(page)
+        return pages, cont
+
+    def _page(self, title: str) -> dict:
+        return {'pageid': self.pageids[title], 'ns': 0, 'title': title}
+
+
+def _select_revs(
+    revs: List[dict], params: Dict[str, str], content: bool,
+) -> Tuple[List[dict], Optional[int]]:
+    newer = params.get('rvdir') == 'newer'
+    revs = revs if newer else list(reversed(revs))
+    start = params.get('rvcontinue', params.get('rvstartid'))
+    end = params.get('rvendid')
+    if start is not None:
+        start = int(start)
+        revs = [rev for rev in revs if (rev['revid'] >= start if newer else rev['revid'] <= start)]
+        if 'rvcontinue' not in params and not any(rev['revid'] == start for rev in revs):
+            return [], None
+    if end is not None:
+        end = int(end)
+        revs = [rev for rev in revs if (rev['revid'] <= end if newer else rev['revid'] >= end)]
+    limit = params.get('rvlimit', '1')
+    limit = (50 if content else 500) if limit == 'max' else int(limit)
+    if 'rvlimit' in params and len(revs) > limit:
+        return revs[:limit], revs[limit]['revid']
+    return revs[:limit], None
+
+def _format_rev(rev: dict, props: set) -> dict:
+    result = {}
+    if 'ids' in props:
+        result['revid'] = rev['revid']
+        result['parentid'] = rev['parentid']
+    if 'size' in props:
+        result['size'] = len(rev.get('content', '').encode())
+    if 'content' in props:
+        if rev.get('hidden'):
+            result['slots'] = {'main': {'texthidden': True}}
+        else:
+            result['slots'] = {'main': {
+                'contentmodel': 'wikitext',
+                'contentformat': 'text/x-wiki',
+                'content': rev['content'],
+            }}
+    return result
+
+
+class _Handler(BaseHTTPRequestHandler):
+    wiki: FakeWiki
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        query = urllib.parse.urlparse(self.path).query
+        self._respond(dict(urllib.parse.parse_qsl(query)))
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self._respond(dict(urllib.parse.parse_qsl(self.rfile.read(length).decode())))
+
+    def _respond(self, params: Dict[str, str]):
+        body = self.wiki.handle(params)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def serve(wiki: FakeWiki, port: int = 0) -> ThreadingHTTPServer:
+    # Serves the wiki from a background thread; the API URL is http://127.0.0.1:<port>/
+    handler = type('Handler', (_Handler,), {'wiki': wiki})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,272 @@
+import argparse
+import dataclasses
+import datetime
+import json
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+from pathlib import Path
+import platform
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+from cci.delta import added_lines
+from cci.editstore import iter_edits
+from cci.revstore import open_store
+
+from .fakeapi import FakeWiki, serve
+from .synth import SynthParams, generate
+
+_REPO = Path(__file__).resolve().parent.parent
+STAGES = ['fetch_cci', 'fetch_diffs', 'build_edits', 'cull_diffs', 'apply_cull']
+
+def run_benchmark(
+    params: SynthParams,
+    work_dir: Path,
+    jobs: int = 4,
+    stage_args: Optional[Dict[str, List[str]]] = None,
+) -> dict:
+    stage_args = stage_args or {}
+    logging.info('generating synthetic case...')
+    wiki = _WikiProcess(params)
+    synth = wiki.synth
+
+    shutil.copy(_REPO / 'moths' / 'rules.yaml', work_dir / 'rules.yaml')
+    (work_dir / 'logs').mkdir(exist_ok=True)
+    env = dict(
+        os.environ,
+        CCI_API_URL=f'http://127.0.0.1:{wiki.port}/',
+        CCI_CACHE_DIR=str(work_dir / 'cache'),
+        PYTHONPATH=str(_REPO),
+    )
+    commands = {
+        'fetch_cci': ['-m', 'cci.fetch_cci', params.name, '-o', str(work_dir), '-j', str(jobs)],
+        'fetch_diffs': ['-m', 'cci.fetch_diffs', str(work_dir), '-j', str(jobs)],
+        'build_edits': ['-m', 'cci.build_edits', str(work_dir)],
+        'cull_diffs': ['-m', 'cci.cull_diffs', str(work_dir), '-b', '1', '--no-cache',
+                       '--no-preprocess-cache'],
+        'apply_cull': ['-m', 'cci.apply_cull', str(work_dir), '-c', params.name, '-b', '1'],
+    }
+
+    counts = {'diffs': synth.diffs, 'case_lines': synth.case_lines}
+    stages = {}
+    try:
+        for stage in STAGES:
+            logging.info(f'running {stage}...')
+            wiki.call('reset')
+            cmd = [sys.executable] + commands[stage] + stage_args.get(stage, [])
+            before = _dir_size(work_dir)
+            result = _run_stage(cmd, env, work_dir / 'logs' / stage)
+            result['output_bytes'] = _dir_size(work_dir) - before
+            result['api_requests'], result['api_bytes'] = wiki.call('stats')
+
+            if stage == 'fetch_diffs':
+                counts['revision_lines'] = _in_subprocess(_count_revision_lines, work_dir)
+            elif stage == 'build_edits':
+                counts['delta_lines'] = _in_subprocess(_count_delta_lines, work_dir)
+            lines = counts[{
+                'fetch_cci': 'case_lines',
+                'fetch_diffs': 'revision_lines',
+                'build_edits': 'revision_lines',
+                'cull_diffs': 'delta_lines',
+                'apply_cull': 'case_lines',
+            }[stage]]
+            result['diffs_per_s'] = round(counts['diffs'] / result['seconds'], 1)
+            result['lines_per_s'] = round(lines / result['seconds'], 1)
+            stages[stage] = result
+    finally:
+        wiki.close()
+
+    return {
+        'version': 1,
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': dataclasses.asdict(params),
+        'stage_args': stage_args,
+        'counts': dict(counts, revisions=synth.revisions),
+        'stages': stages,
+    }
+
+class _WikiProcess:
+    # Stage processes are forked from this one, and a child's peak RSS starts out at its parent's
+    # RSS, so the synthetic wiki is built and served from a process of its own
+    def __init__(self, params: SynthParams):
+        self._conn, child = multiprocessing.Pipe()
+        self._proc = multiprocessing.Process(target=_serve_wiki, args=(params, child), daemon=True)
+        self._proc.start()
+        self.port, self.synth = self._conn.recv()
+
+    def call(self, command: str):
+        self._conn.send(command)
+        return self._conn.recv()
+
+    def close(self):
+        self.call('stop')
+        self._proc.join()
+
+def _serve_wiki(params: SynthParams, conn: multiprocessing.connection.Connection):
+    wiki = FakeWiki()
+    synth = generate(params, wiki)
+    server = serve(wiki)
+    conn.send((server.server_address[1], synth))
+    while True:
+        command = conn.recv()
+        if command == 'reset':
+            wiki.reset_stats()
+            conn.send(None)
+        elif command == 'stats':
+            conn.send((wiki.num_requests, wiki.bytes_sent))
+        elif command == 'stop':
+            server.shutdown()
+            conn.send(None)
+            return
+
+def _in_subprocess(func: Callable, *args):
+    # Keeps whatever func loads out of this process's RSS
+    with multiprocessing.Pool(1) as pool:
+        return pool.apply(func, args)
+
+def _run_stage(cmd: List[str], env: Dict[str, str], log_path: Path) -> dict:
+    out_path, err_path = log_path.with_suffix('.out'), log_path.with_suffix('.log')
+    with out_path.open('wb') as out, err_path.open('wb') as err:
+        start = time.perf_counter()
+        proc = subprocess.Popen(cmd, cwd=_REPO, env=env, stdout=out, stderr=err)
+        # wait4 gives the resource usage of this child alone
+        _, status, usage = os.wait4(proc.pid, 0)
+        elapsed = time.perf_counter() - start
+        proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode:
+        sys.stderr.write(err_path.read_text()[-2000:])
+        raise RuntimeError(f'{shlex.join(cmd)} exited with status {proc.returncode}')
+    return {
+        'seconds': round(elapsed, 3),
+        'peak_rss_kib': usage.ru_maxrss,
+    }
+
+def _dir_size(path: Path) -> int:
+    return sum(
+        child.stat().st_size for child in path.rglob('*')
+        if child.is_file() and child.parts[len(path.parts)] not in ('cache', 'logs')
+    )
+
+def _count_revision_lines(work_dir: Path) -> int:
+    with open_store(work_dir) as store:
+        return sum(
+            data['content'].count('\n') + 1
+            for data in map(store.get, store) if 'content' in data
+        )
+
+def _count_delta_lines(work_dir: Path) -> int:
+    with open_store(work_dir) as store:
+        return sum(
+            len(added_lines(edit.before.get_raw(store), edit.after.get_raw(store)))
+            for edit in iter_edits(work_dir / 'edits.jsonl.gz')
+        )
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=_REPO, capture_output=True, text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _print_results(results: dict, baseline: Optional[dict] = None):
+    print(f"{'stage':<12} {'seconds':>9} {'diffs/s':>10} {'lines/s':>11} {'RSS MiB':>8} "
+          f"{'output KiB':>11} {'requests':>9}")
+    for stage, result in results['stages'].items():
+        line = (
+            f"{stage:<12} {result['seconds']:>9.2f} {result['diffs_per_s']:>10.1f} "
+            f"{result['lines_per_s']:>11.1f} {result['peak_rss_kib'] / 1024:>8.1f} "
+            f"{result['output_bytes'] / 1024:>11.1f} {result['api_requests']:>9}"
+        )
+        base = baseline and baseline['stages'].get(stage)
+        if base:
+            line += f"  ({_change(base['seconds'], result['seconds'])} time, " \
+                    f"{_change(base['peak_rss_kib'], result['peak_rss_kib'])} RSS)"
+        print(line)
+
+def _change(old: float, new: float) -> str:
+    return f'{(new - old) / old * 100:+.1f}%' if old else 'n/a'
+
+def _regressions(results: dict, baseline: dict, threshold: float) -> List[str]:
+    found = []
+    for stage, result in results['stages'].items():
+        base = baseline['stages'].get(stage)
+        if not base:
+            continue
+        for key in ['seconds', 'peak_rss_kib', 'output_bytes']:
+            if base[key] and (result[key] - base[key]) / base[key] > threshold:
+                found.append(f'{stage} {key}: {base[key]} -> {result[key]}')
+    return found
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the cci pipeline on a synthetic case.')
+    scale = parser.add_argument_group('scale')
+    defaults = SynthParams()
+    for field in dataclasses.fields(SynthParams):
+        default = getattr(defaults, field.name)
+        scale.add_argument(f"--{field.name.replace('_', '-')}", type=field.type,
+                           default=default, metavar=field.metadata['metavar'],
+                           help=f"{field.metadata['help']} (default: {default})")
+    parser.add_argument('-j', '--jobs', type=int, default=4,
+                        help='Concurrent API requests for the fetch stages')
+    parser.add_argument('--stage-args', nargs=2, action='append', metavar=('STAGE', 'ARGS'),
+                        default=[], help='Extra arguments for a stage, e.g. cull_diffs "-w 4"')
+    parser.add_argument('--work-dir', type=Path,
+                        help='Where to put the case (default: a temporary directory)')
+    parser.add_argument('-o', '--output', type=Path, help='Write results as JSON')
+    parser.add_argument('--compare', type=Path, metavar='RESULTS',
+                        help='Compare against earlier results and fail on regressions')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Relative slowdown counted as a regression (default: 0.1)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)-7s] %(message)s')
+
+    for stage, _ in args.stage_args:
+        if stage not in STAGES:
+            parser.error(f'unknown stage {stage!r}')
+    stage_args = {stage: shlex.split(extra) for stage, extra in args.stage_args}
+    params = SynthParams(**{
+        field.name: getattr(args, field.name) for field in dataclasses.fields(SynthParams)
+    })
+
+    if args.work_dir:
+        args.work_dir.mkdir(parents=True, exist_ok=True)
+        results = run_benchmark(params, args.work_dir, args.jobs, stage_args)
+    else:
+        with tempfile.TemporaryDirectory(prefix='cci-bench-') as tmp:
+            results = run_benchmark(params, Path(tmp), args.jobs, stage_args)
+
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        with args.output.open('w') as fp:
+            json.dump(results, fp, indent=2)
+            fp.write('\n')
+
+    baseline = None
+    if args.compare:
+        with args.compare.open() as fp:
+            baseline = json.load(fp)
+        if baseline['params'] != results['params']:
+            logging.warning('baseline was run with different parameters')
+    _print_results(results, baseline)
+
+    if baseline:
+        regressions = _regressions(results, baseline, args.threshold)
+        for regression in regressions:
+            logging.error(f'regression: {regression}')
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
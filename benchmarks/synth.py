@@ -0,0 +1,161 @@
+from dataclasses import dataclass, field
+import random
+from typing import List
+
+from .fakeapi import FakeWiki
+
+CCI_PREFIX = 'Wikipedia:Contributor copyright investigations/'
+
+_SYLLABLES = ['ag', 'on', 'op', 'te', 'rix', 'ste', 'phen', 'sia', 'per', 'it', 'tia', 'mo', 'lo',
+              'cal', 'dry', 'as', 'noc', 'tu', 'id', 'ae', 'leu', 'co', 'ma', 'ra', 'psy', 'che']
+_AUTHORS = ['Hübner', 'Walsingham', 'Meyrick', 'Zeller', 'Staudinger', 'Fabricius', 'Walker']
+_FAMILIES = ['Noctuidae', 'Depressariidae', 'Tortricidae', 'Geometridae', 'Crambidae']
+_PLACES = ['China', 'Japan', 'Russia', 'Mongolia', 'India', 'Nepal', 'Siberia', 'Korea']
+_WORDS = ('the of and species larvae feed on leaves adults wing from may to july forewings are '
+          'brown with dark markings hindwings grey it is found in forests at high altitude '
+          'specimens were collected near river valley during survey type locality').split()
+
+def _param(default, help: str, metavar: str = 'N'):
+    # The help and metavar are used for the option benchmarks/run.py adds for each parameter
+    return field(default=default, metadata={'help': help, 'metavar': metavar})
+
+@dataclass
+class SynthParams:
+    name: str = _param('Synthetic', 'Case title, without the CCI prefix', 'TITLE')
+    case_pages: int = _param(3, 'Case pages, counting the main one')
+    sections: int = _param(5, 'Sections on each case page')
+    pages: int = _param(20, 'Articles listed in each section')
+    diffs: int = _param(3, 'Average listed diffs per article')
+    article_lines: int = _param(60, "Lines in each article when it's first created")
+    churn: int = _param(6, 'Lines added by each listed edit; about a third as many are removed')
+    other_edits: float = _param(
+        0.3, 'Chance of an unlisted edit by someone else before each listed one', 'P')
+    missing: float = _param(
+        0.01, 'Fraction of listed diffs whose revisions no longer exist', 'P')
+    seed: int = _param(0, 'Random seed')
+
+@dataclass
+class SynthStats:
+    diffs: int = 0
+    revisions: int = 0
+    case_lines: int = 0
+    article_lines: int = 0
+
+def generate(params: SynthParams, wiki: FakeWiki) -> SynthStats:
+    # Adds a case's pages and the articles it lists to the wiki
+    rng = random.Random(params.seed)
+    stats = SynthStats()
+    revid = 100_000
+    titles = set()
+    page_num = 1
+    case_titles = [CCI_PREFIX + params.name] + [
+        f'{CCI_PREFIX}{params.name} {index}' for index in range(2, params.case_pages + 1)
+    ]
+
+    for casepage, case_title in enumerate(case_titles):
+        lines = ['{{CCI}}']
+        if casepage == 0:
+            lines += [f'[[{title}]]' for title in case_titles[1:]]
+        lines += ['== Background ==', 'Synthetic case for benchmarking.', f'== {params.name} ==']
+        for _ in range(params.sections):
+            lines.append(f'=== Pages {page_num} through {page_num + params.pages - 1} ===')
+            page_num += params.pages
+            for _ in range(params.pages):
+                title = _new_title(rng, titles)
+                revs, listed, revid = _make_history(rng, params, revid)
+                wiki.add_page(title, revs)
+                stats.revisions += len(revs)
+                stats.article_lines += sum(rev['content'].count('\n') + 1 for rev in revs)
+                diffs = ''.join(f'[[Special:Diff/{diff}|(+{size})]]' for diff, size in listed)
+                new = "'''N''' " if revs[0]['revid'] == listed[0][0] else ''
+                count = f"{len(listed)} edit{'s' if len(listed) > 1 else ''}"
+                lines.append(f'*{new}[[:{title}]] ({count}): {diffs}')
+                stats.diffs += len(listed)
+        wiki.add_page(case_title, [{'revid': revid, 'parentid': 0, 'content': '\n'.join(lines)}])
+        revid += 1
+        stats.case_lines += len(lines)
+
+    return stats
+
+def _new_title(rng: random.Random, titles: set) -> str:
+    while True:
+        genus = ''.join(rng.choices(_SYLLABLES, k=rng.randint(2, 4))).capitalize()
+        title = f"{genus} {''.join(rng.choices(_SYLLABLES, k=rng.randint(2, 3)))}"
+        if title not in titles:
+            titles.add(title)
+            return title
+
+def _make_history(rng: random.Random, params: SynthParams, revid: int):
+    # Returns the article's revisions, the listed diffs as (revid, size) pairs and the next revid
+    revs: List[dict] = []
+    listed = []
+    text: List[str] = []
+    created = rng.random() < 0.3
+    if not created:
+        text = [_line(rng) for _ in range(params.article_lines)]
+        revs.append({'revid': revid, 'parentid': 0, 'content': '\n'.join(text)})
+        revid += rng.randint(1, 5)
+
+    num_diffs = rng.randint(1, max(1, 2 * params.diffs - 1))
+    for i in range(num_diffs):
+        if revs and rng.random() < params.other_edits:
+            text = _edit(rng, text, 1, 0.45)
+            revs.append({'revid': revid, 'parentid': revs[-1]['revid'],
+                         'content': '\n'.join(text)})
+            revid += rng.randint(1, 5)
+        before = len('\n'.join(text).encode()) if revs else 0
+        # Many edits only add boilerplate the rules can cull
+        prose = 0.0 if rng.random() < 0.5 else 0.45
+        if i == 0 and created:
+            text = [_line(rng, prose) for _ in range(params.article_lines)]
+        else:
+            text = _edit(rng, text, params.churn, prose)
+        content = '\n'.join(text)
+        listed.append((revid, max(1, len(content.encode()) - before)))
+        if rng.random() >= params.missing:
+            revs.append({'revid': revid, 'parentid': revs[-1]['revid'] if revs else 0,
+                         'content': content})
+        revid += rng.randint(1, 5)
+
+    if not revs:
+        # Every listed revision is missing: the page was deleted
+        revs.append({'revid': revid, 'parentid': 0, 'content': '\n'.join(text)})
+        revid += 1
+    return revs, listed, revid
+
+def _edit(rng: random.Random, text: List[str], churn: int, prose: float) -> List[str]:
+    text = list(text)
+    for _ in range(churn // 3):
+        if text:
+            text.pop(rng.randrange(len(text)))
+    for _ in range(churn):
+        text.insert(rng.randint(0, len(text)), _line(rng, prose))
+    return text
+
+def _line(rng: random.Random, prose: float = 0.45) -> str:
+    genus = ''.join(rng.choices(_SYLLABLES, k=rng.randint(2, 4))).capitalize()
+    species = ''.join(rng.choices(_SYLLABLES, k=rng.randint(2, 3)))
+    author, year = rng.choice(_AUTHORS), rng.randint(1758, 2020)
+    family, place = rng.choice(_FAMILIES), rng.choice(_PLACES)
+    if rng.random() < prose:
+        # Text the rules shouldn't cull
+        return rng.choice([
+            ' '.join(rng.choices(_WORDS, k=rng.randint(8, 40))).capitalize() + '.',
+            f"'''{genus} {species}''' is a moth of the family [[{family}]]. "
+            f"It is found in [[{place}]].",
+            f'* [http://www.example.org/{genus.lower()}/{species} {genus} {species}] at Funet',
+            f'* {author} ({year}). "A revision of the genus {genus}". '
+            f'Zootaxa {rng.randint(1, 999)}.',
+            f'The wingspan is {rng.randint(5, 40)}–{rng.randint(41, 80)} mm.',
+        ])
+    return rng.choice([
+        f'[[Category:Moths of {place}]]',
+        f'[[Category:Moths described in {year}]]',
+        f"*''[[{genus} {species}]]'' ({author}, {year})",
+        f'{{{{{family}-stub}}}}',
+        f'== {rng.choice(["Distribution", "Description", "References", "Subspecies"])} ==',
+        f'| image_caption = Adult, {rng.randint(1, 40) / 10} cm',
+        f'[[File:{genus}_{species}.jpg|thumb|{genus} {species}]]',
+        '{{Reflist}}',
+        '<references/>',
+    ])
@@ -1,5 +1,13 @@
-from pywikiapi import wikipedia
+import os
 
-site = wikipedia('en', headers={
+from pywikiapi import AttrDict, Site, wikipedia
+
+_HEADERS = {
     'User-Agent': 'Mozilla/5.0 (compatible; EarwigBotCCI/0.1; +wikipedia.earwig@gmail.com)'
-})
+}
+
+if 'CCI_API_URL' in os.environ:
+    # Point at another MediaWiki API, e.g. a local fake one for testing
+    site = Site(os.environ['CCI_API_URL'], headers=_HEADERS, json_object_hook=AttrDict)
+else:
+    site = wikipedia('en', headers=_HEADERS)
@@ -1,12 +1,17 @@
 #!/usr/bin/env python3
 
 import argparse
+import functools
 import gzip
 import hashlib
+import itertools
 import json
+import logging
+import multiprocessing
 from pathlib import Path
 import re
-from typing import List, Optional
+import time
+from typing import List, Optional, Tuple
 
 import jinja2
 
@@ -14,20 +19,69 @@ from . import utils
 from .case import Edit
 
 _LINK_ROOT = 'toolforge:earwig-dev/cci'
+_DIFF_LINK = re.compile(r'\[\[Special:Diff/(\d+)\|')
+_DIFF_LINK_SIZE = re.compile(r'\[\[Special:Diff/(\d+)\|\(\+\d+\)\]\]')
+_PAGE_LINE = re.compile(r"\*(?:'''N''' )?\[\[:(.*)\]\] \(\d+ edits?\): ")
 
-def apply_cull(root: Path, case_name: str, case_page: Optional[str], batch: str, skip_edits: bool):
+def apply_cull(
+    root: Path,
+    case_name: str,
+    case_page: Optional[str],
+    batch: str,
+    skip_edits: bool,
+    workers: int = 1,
+    report_path: Optional[Path] = None,
+    chunk_size: int = 100,
+):
     dirname = f'cull/batch-{batch.zfill(2)}'
     if case_page:
         case_pages = [case_page]
     else:
-        case_pages = [
+        case_pages = sorted((
             re.match(r'page-(\d+).json.gz', name.name).group(1)
             for name in (root / dirname).iterdir()
             if name.name.endswith('.json.gz')
-        ]
+        ), key=int)
+
+    start = time.perf_counter()
+    args = [
+        (root, dirname, case_name, name, batch, skip_edits, chunk_size)
+        for name in case_pages
+    ]
+    if workers > 1 and len(args) > 1:
+        # Compile the template before forking so every worker shares it
+        _viewer_template()
+        pool = multiprocessing.Pool(min(workers, len(args)))
+        results = pool.imap(_apply_cull_worker, args)
+    else:
+        pool = None
+        results = map(_apply_cull_worker, args)
+
+    pages = []
+    try:
+        for result in results:
+            edit = result.pop('edit')
+            if edit:
+                print(json.dumps(edit))
+            pages.append(result)
+    finally:
+        if pool:
+            pool.terminate()
 
-    for name in case_pages:
-        _apply_cull(root, dirname, case_name, name, batch, skip_edits)
+    elapsed = time.perf_counter() - start
+    logging.info(f'applied cull to {len(pages)} case pages in {elapsed:.1f}s')
+    if report_path:
+        with report_path.open('w') as fp:
+            json.dump({
+                'case': root.name,
+                'batch': batch,
+                'seconds': round(elapsed, 3),
+                'pages': pages,
+            }, fp, indent=2)
+            fp.write('\n')
+
+def _apply_cull_worker(args: tuple) -> dict:
+    return _apply_cull(*args)
 
 def _apply_cull(
     root: Path,
@@ -36,88 +90,148 @@ def _apply_cull(
     case_page: str,
     batch: str,
     skip_edits: bool,
-):
+    chunk_size: int,
+) -> dict:
+    start = time.perf_counter()
     key = f'{dirname}/page-{case_page}'
     cull_path = root / f'{key}.json.gz'
     html_path = root / f'{key}.html'
+    view_path = root / f'{key}.view'
 
     with gzip.open(cull_path, 'rt') as fp:
-        edits = [Edit.load(edit) for edit in json.load(fp)]
+        raw_edits = json.load(fp)
+    edits = [Edit.load(edit) for edit in raw_edits]
+    num_chunks = _write_view(view_path, raw_edits, chunk_size)
 
     title = f'{utils.CCI_PREFIX}{case_name}'
     if int(case_page) != 1:
         title += f' {case_page}'
 
+    edit = removed_diffs = total_diffs = None
     if not skip_edits:
-        _build_edit(root, key, title, edits)
-
-    env = jinja2.Environment(
-        loader=jinja2.FileSystemLoader(Path(__file__).parent / 'templates'),
-        autoescape=jinja2.select_autoescape(['html', 'xml'])
-    )
-    env.filters['titleencode'] = lambda title: title.replace(' ', '_')
-    template = env.get_template('viewer.html')
+        edit, removed_diffs, total_diffs = _build_edit(root, key, title, edits)
 
     with html_path.open('w') as htmlfp:
-        htmlfp.write(template.render(
+        htmlfp.write(_viewer_template().render(
             case=root.name,
             name=case_name,
             page=case_page,
             prefix=utils.CCI_PREFIX,
             title=title,
             batch=f'batch {batch}',
-            path=cull_path.name,
+            path=f'{view_path.name}/manifest.json',
             static_url=_static_url,
         ))
 
-def _build_edit(root: Path, key: str, title: str, edits: List[Edit]):
+    return {
+        'page': case_page,
+        'title': title,
+        'html': str(html_path.relative_to(root)),
+        'culled_diffs': len(edits),
+        'view_chunks': num_chunks,
+        'removed_diffs': removed_diffs,
+        'total_diffs': total_diffs,
+        'seconds': round(time.perf_counter() - start, 3),
+        'edit': edit,
+    }
+
+def _write_view(view_path: Path, edits: List[dict], chunk_size: int) -> int:
+    # The viewer only needs each edit's added lines and how they were culled, not the revision
+    # text, so it gets a slimmed-down copy split into chunks that it can load as needed
+    view_path.mkdir(exist_ok=True)
+    for path in view_path.glob('chunk-*.json.gz'):
+        path.unlink()
+
+    chunks = []
+    for i in range(0, len(edits), chunk_size):
+        chunk = [_slim_edit(edit) for edit in edits[i:i + chunk_size]]
+        name = f'chunk-{len(chunks):04d}.json.gz'
+        with gzip.open(view_path / name, 'wt') as fp:
+            json.dump(chunk, fp, separators=(',', ':'))
+        chunks.append({
+            'path': name,
+            'edits': len(chunk),
+            'sections': [section for section, _ in itertools.groupby(
+                edit['section'] for edit in chunk)],
+        })
+
+    with (view_path / 'manifest.json').open('w') as fp:
+        json.dump({'version': 1, 'edits': len(edits), 'chunks': chunks}, fp)
+    return len(chunks)
+
+def _slim_edit(edit: dict) -> dict:
+    lines = edit['delta']['lines'] if edit.get('delta') else []
+    return {
+        'section': edit['section'],
+        'page': edit['page'],
+        'diff': edit['diff'],
+        'lines': [
+            {
+                'index': line['index'],
+                'text': line['text'],
+                'culled': line['culled'],
+                'rules': line['rules'],
+            }
+            for line in lines
+        ],
+    }
+
+@functools.cache
+def _viewer_template() -> jinja2.Template:
+    env = jinja2.Environment(
+        loader=jinja2.FileSystemLoader(Path(__file__).parent / 'templates'),
+        autoescape=jinja2.select_autoescape(['html', 'xml'])
+    )
+    env.filters['titleencode'] = lambda title: title.replace(' ', '_')
+    return env.get_template('viewer.html')
+
+def _build_edit(
+    root: Path, key: str, title: str, edits: List[Edit],
+) -> Tuple[dict, int, int]:
     revid, content = utils.get_title_revision(title)
 
     total_diffs = content.count('[[Special:Diff/')
+    culled = {str(edit.diff): (i, edit.page) for i, edit in enumerate(edits)}
     removed_diffs = 0
-    lines = content.strip().splitlines()
-    for i, line in reversed(list(enumerate(lines))):
-        changed = False
-        page = ''
-        for edit in edits:
-            if f'[[Special:Diff/{edit.diff}|' in line:
-                line = re.sub(rf'\[\[Special:Diff/{edit.diff}\|\(\+\d+\)\]\]', '', line)
-                changed = True
-                page = edit.page
-                removed_diffs += 1
-        if changed:
-            if 'Special:Diff' not in line and re.fullmatch(
-                    rf"\*('''N''' )?\[\[:{re.escape(page)}\]\] \(\d+ edits?\): ", line):
-                lines.pop(i)
-            else:
-                lines[i] = line
-
+    lines = []
+    section_start = None
     has_content = False
-    last_header = None
-    for i, line in reversed(list(enumerate(lines))):
+    for line in content.strip().splitlines():
+        found = {diff for diff in _DIFF_LINK.findall(line) if diff in culled}
+        if found:
+            removed_diffs += len(found)
+            line = _DIFF_LINK_SIZE.sub(lambda m: '' if m.group(1) in found else m.group(0), line)
+            _, page = max(culled[diff] for diff in found)
+            # Drop the page's line once all of its diffs are gone
+            if 'Special:Diff' not in line:
+                match = _PAGE_LINE.fullmatch(line)
+                if match and match.group(1) == page:
+                    continue
+
         if line.startswith('=== Pages '):
-            if has_content:
-                has_content = False
-            elif last_header:
+            if section_start is not None and not has_content:
                 # Remove empty section
-                for _ in range(last_header - i):
-                    lines.pop(i)
-            last_header = i
+                del lines[section_start:]
+            section_start = len(lines)
+            has_content = False
         elif line:
             has_content = True
+        lines.append(line)
 
     content = '\n'.join(lines) + '\n'
     summary = (
         f'tool-assisted cull: -{removed_diffs}/{total_diffs} diffs '
         f'([[{_LINK_ROOT}/{root.name}/{key}.html|more info]])'
     )
-    print(json.dumps({
+    edit = {
         'title': title,
         'content': content,
         'revid': revid,
         'summary': summary,
-    }))
+    }
+    return edit, removed_diffs, total_diffs
 
+@functools.cache
 def _static_url(filename: str) -> str:
     with (Path(__file__).parent.parent / 'static' / filename).open('rb') as fp:
         fhash = hashlib.sha1(fp.read()).hexdigest()
@@ -132,11 +246,18 @@ def main():
                         help='Batch number or name')
     parser.add_argument('--skip-edits', action='store_true',
                         help='Skip generating edits to apply on-wiki')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='Number of case pages to process in parallel')
+    parser.add_argument('--report', metavar='PATH', type=Path,
+                        help='Write a JSON report of the processed case pages')
+    parser.add_argument('--chunk-size', metavar='N', type=int, default=100,
+                        help='Number of edits in each chunk loaded by the viewer')
     args = parser.parse_args()
     utils.setup_logging()
 
     root = Path(args.case)
-    apply_cull(root, args.case_name, args.case_page, args.batch, args.skip_edits)
+    apply_cull(root, args.case_name, args.case_page, args.batch, args.skip_edits,
+               workers=args.workers, report_path=args.report, chunk_size=args.chunk_size)
 
 if __name__ == '__main__':
     main()
@@ -2,64 +2,87 @@
 
 import argparse
 import functools
-import gzip
-import json
 from pathlib import Path
+from typing import Union
 
 import tqdm
 
 from . import utils
-from .case import Case, Edit, Revision
+from .case import Case, Delta, Edit, Revision
+from .casestore import CaseStore, load_case
+from .editstore import EditWriter
+from .revstore import CachedStore, RevisionStore, open_cache, open_store
 
-def build_edits(case: Case, rev_dir: Path, edits_path: Path):
-    edits = []
-
-    all_diffs = [
-        (casepage, section, page, diff)
-        for casepage in case.pages.values()
-        for section in casepage.sections.values()
-        for page in section.pages
-        for diff in page.diffs
-    ]
-    for (casepage, section, page, diff) in tqdm.tqdm(all_diffs, unit='diffs'):
-        rev = _load_rev(rev_dir, diff.revid)
-        if 'missing' in rev:
-            continue
-        if rev['parentid'] == 0:
-            prev = {'content': ''}
-        else:
-            prev = _load_rev(rev_dir, rev['parentid'])
-            if 'missing' in prev:
+def build_edits(
+    case: Union[Case, CaseStore],
+    store: RevisionStore,
+    edits_path: Path,
+    embed_text: bool = False,
+    precompute_delta: bool = False,
+    multiset_delta: bool = False,
+):
+    all_diffs = list(case.iter_diffs())
+    with EditWriter(edits_path) as writer:
+        for (casepage, section, page, diff) in tqdm.tqdm(all_diffs, unit='diffs'):
+            rev = _load_rev(store, diff.revid)
+            if 'missing' in rev:
                 continue
-            assert rev['title'] == prev['title']
-
-        edits.append(Edit(
-            casepage=casepage.index,
-            section=section.title,
-            page=page.title,
-            diff=diff.revid,
-            before=Revision(prev['content']),
-            after=Revision(rev['content']),
-        ))
+            if rev['parentid'] == 0:
+                prev = {'content': ''}
+            else:
+                # A parent is always from the same page, so titles aren't compared: they can
+                # differ if the page moved between fetching the two, e.g. when one came from
+                # the revision cache or a dump
+                prev = _load_rev(store, rev['parentid'])
+                if 'missing' in prev:
+                    continue
 
-    with gzip.open(edits_path, 'wt') as fp:
-        json.dump([edit.dump() for edit in edits], fp)
+            if embed_text:
+                before = Revision(prev['content'], revid=rev['parentid'] or None)
+                after = Revision(rev['content'], revid=diff.revid)
+            else:
+                before = Revision(revid=rev['parentid']) if rev['parentid'] else Revision('')
+                after = Revision(revid=diff.revid)
+            writer.write(Edit(
+                casepage=casepage.index,
+                section=section.title,
+                page=page.title,
+                diff=diff.revid,
+                before=before,
+                after=after,
+                delta=(Delta.between(prev['content'], rev['content'], multiset_delta)
+                       if precompute_delta else None),
+            ))
 
-@functools.cache
-def _load_rev(rev_dir: Path, revid: int):
-    path = rev_dir / f'{revid}.json.gz'
-    with gzip.open(path, 'rt') as fp:
-        return json.load(fp)
+# An edit's parent is often the previous listed edit, so only recent revisions are worth keeping
+@functools.lru_cache(maxsize=256)
+def _load_rev(store: RevisionStore, revid: int):
+    return store.get(revid)
 
 def main():
     parser = argparse.ArgumentParser(description='Build edits for CCI')
     parser.add_argument('case', help='Case dir')
+    parser.add_argument('--embed-text', action='store_true',
+                        help='Include full revision text instead of referring to revisions by id')
+    parser.add_argument('--precompute-delta', action='store_true',
+                        help='Include the added lines of each edit')
+    parser.add_argument('--multiset-delta', action='store_true',
+                        help='Count repeated copies of an existing line as added')
+    parser.add_argument('--no-revision-cache', action='store_true',
+                        help="Don't look up revisions missing from the case in the revision cache")
+    parser.add_argument('--revision-cache-size', metavar='MB', type=int, default=10240,
+                        help='Size limit of the revision cache')
     args = parser.parse_args()
     utils.setup_logging()
 
     root = Path(args.case)
-    case = Case.load(root / 'case')
-    build_edits(case, root / 'revs', root / 'edits.json.gz')
+    case = load_case(root)
+    store = open_store(root)
+    if not args.no_revision_cache:
+        store = CachedStore(store, open_cache(args.revision_cache_size << 20))
+    with store:
+        build_edits(case, store, root / 'edits.jsonl.gz', embed_text=args.embed_text,
+                    precompute_delta=args.precompute_delta, multiset_delta=args.multiset_delta)
 
 if __name__ == '__main__':
     main()
@@ -1,23 +1,38 @@
 from __future__ import annotations
 import dataclasses
 from dataclasses import dataclass
+import itertools
 import json
 from pathlib import Path
 import textwrap
-from typing import Dict, List, Optional
+from typing import Dict, Iterable, Iterator, List, Optional, TextIO, Tuple, TYPE_CHECKING
 
 from colorama import Fore, Style
 
-@dataclass
+from .delta import added_lines
+
+if TYPE_CHECKING:
+    from .revstore import RevisionStore
+
+@dataclass(slots=True)
 class Revision:
-    raw: str
+    raw: Optional[str] = None
+    revid: Optional[int] = None
 
     @classmethod
     def load(cls, raw: dict) -> Revision:
         return cls(**raw)
 
+    def get_raw(self, store: Optional[RevisionStore]) -> str:
+        # Edits may refer to revisions by id instead of embedding their text
+        if self.raw is not None:
+            return self.raw
+        if store is None:
+            raise ValueError(f'No revision store to look up revision {self.revid}')
+        return store.get(self.revid)['content']
 
-@dataclass
+
+@dataclass(slots=True)
 class CullRule:
     name: str
     detail: Optional[str] = None
@@ -27,7 +42,7 @@ class CullRule:
         return cls(**raw)
 
 
-@dataclass
+@dataclass(slots=True)
 class Line:
     index: int
     raw: str
@@ -59,19 +74,29 @@ class Line:
     def load(cls, raw: dict) -> Line:
         kwargs = raw.copy()
         kwargs['rules'] = [CullRule.load(rule) for rule in kwargs['rules']]
-        return cls(**raw)
+        return cls(**kwargs)
 
 
-@dataclass
+@dataclass(slots=True)
 class Delta:
     lines: List[Line]
+    # Whether repeated copies of an existing line counted as added
+    multiset: bool = False
 
     @classmethod
     def load(cls, raw: dict) -> Delta:
-        return cls(lines=[Line.load(line) for line in raw['lines']])
+        return cls(lines=[Line.load(line) for line in raw['lines']],
+                   multiset=raw.get('multiset', False))
 
+    @classmethod
+    def between(cls, before: str, after: str, multiset: bool = False) -> Delta:
+        return cls(lines=[
+            Line(index=i, raw=line, text=_strip_line(line))
+            for i, line in added_lines(before, after, multiset)
+        ], multiset=multiset)
 
-@dataclass
+
+@dataclass(slots=True)
 class Edit:
     casepage: str
     section: str
@@ -98,14 +123,34 @@ class Edit:
         return dataclasses.asdict(self)
 
 
+def read_edits(fp: TextIO) -> Iterator[Edit]:
+    # Edits are stored one JSON object per line. Older edits files are a single JSON list,
+    # which can only be read all at once.
+    first = fp.read(1)
+    if first == '[':
+        yield from (Edit.load(raw) for raw in json.loads(first + fp.read()))
+        return
+    for line in itertools.chain([first + fp.readline()], fp):
+        if line.strip():
+            yield Edit.load(json.loads(line))
+
+def write_edits(fp: TextIO, edits: Iterable[Edit]):
+    for edit in edits:
+        fp.write(dump_edit(edit))
+
+def dump_edit(edit: Edit) -> str:
+    return json.dumps(edit.dump()) + '\n'
+
+
 @dataclass
 class Diff:
     revid: int
-    size: str
+    size: int
 
     @classmethod
     def load(cls, raw: dict) -> Diff:
-        return cls(**raw)
+        # Older cases stored sizes as strings like '+123'
+        return cls(revid=raw['revid'], size=int(raw['size']))
 
 
 @dataclass
@@ -154,6 +199,13 @@ class Case:
     def __post_init__(self):
         self.index = list(self.pages.keys())
 
+    def iter_diffs(self) -> Iterator[Tuple[CasePage, Section, Page, Diff]]:
+        for casepage in self.pages.values():
+            for section in casepage.sections.values():
+                for page in section.pages:
+                    for diff in page.diffs:
+                        yield casepage, section, page, diff
+
     @classmethod
     def load(cls, case_dir: Path) -> Case:
         with (case_dir / 'index.json').open('r') as fp:
@@ -170,3 +222,7 @@ class Case:
         for name, page in self.pages.items():
             with (case_dir / f'{name}.json').open('w') as fp:
                 json.dump(dataclasses.asdict(page), fp)
+
+
+def _strip_line(text: str) -> str:
+    return text.strip().replace('\u200e', '')
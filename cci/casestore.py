@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+import argparse
+from array import array
+import itertools
+import json
+import logging
+from pathlib import Path
+import sqlite3
+import sys
+from typing import Dict, Iterator, List, Mapping, Tuple, Union
+
+from . import utils
+from .case import Case, CasePage, Diff, Page
+
+_VERSION = 1
+
+class CaseStore:
+    # A case in a single SQLite file, with one row per case page. Case pages are only read when
+    # used, and keep their page titles and diffs packed into a few strings and integer arrays.
+    def __init__(self, path: Path):
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS casepages (
+                pos INTEGER PRIMARY KEY,
+                name TEXT NOT NULL UNIQUE,
+                sections TEXT NOT NULL,
+                titles TEXT NOT NULL,
+                counts BLOB NOT NULL,
+                revids BLOB NOT NULL,
+                sizes BLOB NOT NULL
+            )
+        """)
+        self.index: List[str] = [
+            name for name, in self._conn.execute('SELECT name FROM casepages ORDER BY pos')
+        ]
+        self.pages: Mapping[str, PackedCasePage] = _LazyPages(self)
+
+    def page(self, name: str) -> PackedCasePage:
+        row = self._conn.execute(
+            'SELECT sections, titles, counts, revids, sizes FROM casepages WHERE name = ?', (name,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(name)
+        sections, titles, counts, revids, sizes = row
+        return PackedCasePage(
+            index=name,
+            section_info=json.loads(sections),
+            titles=titles.split('\n') if titles else [],
+            counts=_unpack('I', counts),
+            revids=_unpack('q', revids),
+            sizes=_unpack('q', sizes),
+        )
+
+    def iter_diffs(self) -> Iterator[Tuple[PackedCasePage, PackedSection, Page, Diff]]:
+        for name in self.index:
+            yield from self.page(name).iter_diffs()
+
+    def save(self, case: Union[Case, CaseStore]):
+        with self._conn:
+            self._conn.execute('DELETE FROM casepages')
+            self._conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                               ('version', str(_VERSION)))
+            for pos, name in enumerate(case.index):
+                self._conn.execute(
+                    'INSERT INTO casepages VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (pos, name, *_pack_page(case.pages[name])),
+                )
+        self.index = list(case.index)
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self) -> CaseStore:
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _LazyPages(Mapping):
+    def __init__(self, store: CaseStore):
+        self._store = store
+
+    def __getitem__(self, name: str) -> PackedCasePage:
+        return self._store.page(name)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._store.index)
+
+    def __len__(self) -> int:
+        return len(self._store.index)
+
+
+class PackedCasePage:
+    # Works like CasePage, but builds Page and Diff objects only when they're asked for
+    def __init__(
+        self,
+        index: str,
+        section_info: List[list],
+        titles: List[str],
+        counts: array,
+        revids: array,
+        sizes: array,
+    ):
+        self.index = index
+        self.titles = titles
+        self.counts = counts
+        self.revids = revids
+        self.sizes = sizes
+        # Where each page's diffs start in revids and sizes
+        self.offsets = array('q', itertools.accumulate(counts, initial=0))
+        self.sections: Dict[str, PackedSection] = {}
+        start = 0
+        for key, title, num_pages in section_info:
+            self.sections[key] = PackedSection(self, title, start, start + num_pages)
+            start += num_pages
+
+    def page(self, i: int) -> Page:
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return Page(
+            title=self.titles[i],
+            diffs=[Diff(revid, size) for revid, size in
+                   zip(self.revids[start:end], self.sizes[start:end])],
+        )
+
+    def iter_diffs(self) -> Iterator[Tuple[PackedCasePage, PackedSection, Page, Diff]]:
+        for section in self.sections.values():
+            for page in section.pages:
+                for diff in page.diffs:
+                    yield self, section, page, diff
+
+
+class PackedSection:
+    def __init__(self, casepage: PackedCasePage, title: str, start: int, end: int):
+        self.casepage = casepage
+        self.title = title
+        self.start = start
+        self.end = end
+
+    @property
+    def pages(self) -> List[Page]:
+        return [self.casepage.page(i) for i in range(self.start, self.end)]
+
+
+def _pack_page(casepage: Union[CasePage, PackedCasePage]) -> tuple:
+    section_info = []
+    titles = []
+    counts = array('I')
+    revids = array('q')
+    sizes = array('q')
+    for key, section in casepage.sections.items():
+        pages = section.pages
+        section_info.append([key, section.title, len(pages)])
+        for page in pages:
+            assert '\n' not in page.title, page.title
+            titles.append(page.title)
+            counts.append(len(page.diffs))
+            revids.extend(diff.revid for diff in page.diffs)
+            sizes.extend(diff.size for diff in page.diffs)
+    return (
+        json.dumps(section_info),
+        '\n'.join(titles),
+        _pack(counts),
+        _pack(revids),
+        _pack(sizes),
+    )
+
+def _pack(values: array) -> bytes:
+    # Stored little-endian whatever the machine's byte order
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+def _unpack(typecode: str, data: bytes) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+def load_case(root: Path) -> Union[Case, CaseStore]:
+    # Cases fetched before case.db existed keep their JSON files in case/
+    db_path = root / 'case.db'
+    case_dir = root / 'case'
+    if db_path.exists():
+        return CaseStore(db_path)
+    if case_dir.exists():
+        return Case.load(case_dir)
+    raise RuntimeError(f'No case found in {root}; please run fetch_cci first')
+
+def save_case(root: Path, case: Case, backend: str = 'sqlite'):
+    if backend == 'sqlite':
+        with CaseStore(root / 'case.db') as store:
+            store.save(case)
+    elif backend == 'json':
+        case_dir = root / 'case'
+        case_dir.mkdir(parents=True, exist_ok=True)
+        case.save(case_dir)
+    else:
+        raise NotImplementedError(backend)
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate a case's JSON files into case.db")
+    parser.add_argument('case', help='Case dir')
+    args = parser.parse_args()
+    utils.setup_logging()
+
+    root = Path(args.case)
+    case_dir = root / 'case'
+    if not case_dir.exists():
+        raise RuntimeError(f'Case dir {case_dir} does not exist')
+
+    logging.info('migrating case...')
+    save_case(root, Case.load(case_dir))
+    logging.info(f'done; {case_dir} can now be removed')
+
+if __name__ == '__main__':
+    main()
@@ -1,30 +1,32 @@
 #!/usr/bin/env python3
 
+from __future__ import annotations
 import argparse
+from collections import OrderedDict
 from dataclasses import dataclass
 import functools
 import gzip
+import itertools
 import json
 import logging
-import operator
+import multiprocessing
+import multiprocessing.pool
+import multiprocessing.util
 from pathlib import Path
-import re
-from typing import List, Optional
+from typing import Callable, Dict, Iterator, List, Optional, TextIO, Tuple
 
 from colorama import Fore
-import mwparserfromhell
 import tqdm
-import yaml
 
 from . import utils
 from .case import CullRule, Delta, Edit, Line
-
-@dataclass
-class Filters:
-    casepages: Optional[List[str]]
-    sections: Optional[List[str]]
-    pages: Optional[List[str]]
-    diffs: Optional[List[int]]
+from .cullcache import CacheEntry, CullCache
+from .editstore import Filters, count_edits, find_edits, iter_edits
+from .revstore import RevisionStore, open_store
+from .ruleprofile import RuleProfiler
+from .rules import (
+    PreprocessCache, Rule, RuleSet, configure_preprocess_cache, preprocess_cache_stats,
+)
 
 def cull_diffs(
     edits_path: Path,
@@ -37,57 +39,102 @@ def cull_diffs(
     include_all: bool = False,
     hide_culled: bool = False,
     dump_rules: bool = False,
+    workers: int = 1,
+    store_root: Optional[Path] = None,
+    cache_path: Optional[Path] = None,
+    preprocess_cache: Optional[PreprocessCacheOptions] = None,
+    multiset_delta: bool = False,
+    profile_path: Optional[Path] = None,
+    line_cache_entries: int = 100_000,
 ):
-    with gzip.open(edits_path, 'rt') as fp:
-        edits = [Edit.load(edit) for edit in json.load(fp)]
-    with rules_path.open() as fp:
-        rules = yaml.load(fp, yaml.CSafeLoader)
-    rules['whitelist'] = rules.get('whitelist', '').splitlines()
-
-    logging.info(f'analyzing {len(edits)} diffs to cull...')
-    it = edits if verbose else tqdm.tqdm(edits, unit='diffs')
-    result = {}
-    for edit in it:
-        if filters is not None:
-            filtered = False
-            for filt, attr in [
-                (filters.casepages, edit.casepage),
-                (filters.sections, edit.section),
-                (filters.pages, edit.page),
-                (filters.diffs, edit.diff),
-            ]:
-                if filt is not None and attr not in filt:
-                    filtered = True
-                    break
-            if filtered:
+    num_edits = count_edits(edits_path, filters)
+    if num_edits is not None:
+        logging.info(f'analyzing {num_edits} diffs to cull...')
+    edits = iter_edits(edits_path, filters)
+    # The caches aren't consulted in debug or profiling mode, so every rule attempt gets logged
+    # or timed
+    if debug or profile_path:
+        cache_path = None
+        line_cache_entries = 0
+    elif cache_path:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+    if preprocess_cache is None:
+        preprocess_cache = PreprocessCacheOptions()
+    if profile_path and workers > 1:
+        logging.warning('profiling rules in a single process')
+        workers = 1
+    args = (rules_path, debug, store_root, cache_path, preprocess_cache, multiset_delta,
+            line_cache_entries)
+    state = _CullState.open(*args)
+    if profile_path:
+        state.profiler = RuleProfiler(state.rules)
+    if workers > 1:
+        chunksize = max(1, min(64, num_edits // (workers * 4))) if num_edits else 16
+        pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=args)
+        results = _imap_windows(pool, edits, workers * chunksize * 16, chunksize)
+    else:
+        pool = None
+        results = ((edit, _try_cull_edit(edit, state)) for edit in edits)
+
+    it = results if verbose else tqdm.tqdm(results, total=num_edits, unit='diffs')
+    writer = _CullWriter(cull_root / f'batch-{batch.zfill(2)}') if batch else None
+    num_culled = 0
+    page_culled = {}
+    rules = {}
+    unmatched = set()
+    ok = False
+    try:
+        for edit, (delta, edit_ok, cache_entries) in it:
+            edit.delta = delta
+            if state.cache:
+                state.cache.store(cache_entries)
+            num_culled += bool(edit.culled)
+            if dump_rules and edit.delta:
+                for line in edit.delta.lines:
+                    if line.culled:
+                        for rule in line.rules:
+                            rules.setdefault(rule.name, set()).add(line.text)
+                    else:
+                        unmatched.add(line.text)
+            if not edit_ok:
                 continue
-        try:
-            _cull_edit(edit, rules, verbose, debug, hide_culled)
-        except BrokenPipeError:
-            raise
-        except Exception:
-            logging.exception(f'Failed to cull edit: {edit}')
-            continue
-        if edit.culled or include_all:
-            result.setdefault(edit.casepage, []).append(edit)
+            if verbose:
+                _print_edit(edit, hide_culled)
+            if edit.culled or include_all:
+                page_culled[edit.casepage] = page_culled.get(edit.casepage, 0) + bool(edit.culled)
+                if writer:
+                    writer.write(edit)
+        ok = True
+    finally:
+        if pool:
+            # Workers left to exit on their own close their state; terminated ones don't
+            if ok:
+                pool.close()
+                pool.join()
+            else:
+                pool.terminate()
+        state.close()
+        if writer:
+            writer.close(ok)
+
+    if state.cache:
+        logging.info(f'evaluated {state.cache.num_evaluated} uncached line/rule pairs')
+    if workers <= 1:
+        logging.info(f'preprocessing cache: {preprocess_cache_stats()}')
+        if state.lines:
+            logging.info(f'line cache: {state.lines.stats()}')
 
-    logging.info(f'culled {sum(1 for edit in edits if edit.culled)} diffs')
-    for index, page_edits in result.items():
-        num_culled = sum(1 for edit in page_edits if edit.culled)
-        logging.info(f'- culled {num_culled} diffs in case page {index}')
+    if state.profiler:
+        print(state.profiler.table())
+        profile_path.parent.mkdir(parents=True, exist_ok=True)
+        state.profiler.save(profile_path)
+        logging.info(f'saved rule profile to {profile_path}')
+
+    logging.info(f'culled {num_culled} diffs')
+    for index, page_num_culled in page_culled.items():
+        logging.info(f'- culled {page_num_culled} diffs in case page {index}')
 
     if dump_rules:
-        rules = {}
-        unmatched = set()
-        for edit in edits:
-            if not edit.delta:
-                continue
-            for line in edit.delta.lines:
-                if line.culled:
-                    for rule in line.rules:
-                        rules.setdefault(rule.name, set()).add(line.text)
-                else:
-                    unmatched.add(line.text)
         print('Matched rules:')
         for name, lines in rules.items():
             print()
@@ -102,156 +149,257 @@ def cull_diffs(
         else:
             print('No unmatched lines')
 
-    if batch:
-        cull_dir = cull_root / f'batch-{batch.zfill(2)}'
-        cull_dir.mkdir(parents=True, exist_ok=True)
-        for index, page_edits in result.items():
-            cull_path = cull_dir / f'page-{index}.json.gz'
-            with gzip.open(cull_path, 'wt') as fp:
-                json.dump([edit.dump() for edit in page_edits], fp)
-
-def _cull_edit(edit: Edit, rules: dict, verbose: bool, debug: bool, hide_culled: bool):
-    before_lines = set(edit.before.raw.splitlines())
-    lines = [
-        Line(index=i, raw=line, text=_strip_line(line))
-        for i, line in enumerate(edit.after.raw.splitlines(), 1)
-        if line.strip() and line not in before_lines
-    ]
-    edit.delta = Delta(lines=lines)
+def _imap_windows(
+    pool: multiprocessing.pool.Pool,
+    edits: Iterator[Edit],
+    window: int,
+    chunksize: int,
+) -> Iterator[Tuple[Edit, Tuple[Optional[Delta], bool, List[CacheEntry]]]]:
+    # Pool.imap queues up its whole input straight away, so hand it a window of edits at a time
+    while True:
+        batch = list(itertools.islice(edits, window))
+        if not batch:
+            return
+        yield from zip(batch, pool.imap(_cull_worker, batch, chunksize=chunksize))
+
+
+class _CullWriter:
+    # Writes each case page's edits to page-<index>.json.gz as they're culled. The files are only
+    # put in place once the whole run succeeds.
+    def __init__(self, cull_dir: Path):
+        self.cull_dir = cull_dir
+        self._files: Dict[str, TextIO] = {}
+
+    def _path(self, index: str) -> Path:
+        return self.cull_dir / f'page-{index}.json.gz'
+
+    def write(self, edit: Edit):
+        fp = self._files.get(edit.casepage)
+        if fp is None:
+            self.cull_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = self._path(edit.casepage).with_suffix('.tmp')
+            fp = self._files[edit.casepage] = gzip.open(tmp_path, 'wt')
+            fp.write('[')
+        else:
+            fp.write(', ')
+        json.dump(edit.dump(), fp)
+
+    def close(self, ok: bool):
+        for index, fp in self._files.items():
+            fp.write(']')
+            fp.close()
+            tmp_path = self._path(index).with_suffix('.tmp')
+            if ok:
+                tmp_path.replace(self._path(index))
+            else:
+                tmp_path.unlink()
+        self._files = {}
+
+
+@dataclass
+class PreprocessCacheOptions:
+    # In-memory LRU entries, and the on-disk cache shared across runs and cases
+    maxsize: int = 100_000
+    disk_path: Optional[Path] = None
+    disk_max_bytes: int = 1 << 30
+
+
+@dataclass
+class _LineResults:
+    # What the whitelist left of a line and the items it removed, and the result of each rule
+    # tried on it so far, by rule name
+    text: str
+    items: List[str]
+    rules: Dict[str, Optional[CullRule]]
+
+
+class _LineCache:
+    # Results for recently seen lines. The same lines get added in many diffs of a case, so this
+    # lets each distinct line go through the whitelist and rules once per process, while rule
+    # maxes are still counted per edit.
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evaluations = 0
+        self.reused = 0
+        self._entries: OrderedDict[str, _LineResults] = OrderedDict()
+
+    def get(self, text: str) -> Optional[_LineResults]:
+        results = self._entries.get(text)
+        if results is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(text)
+        return results
+
+    def put(self, text: str, results: _LineResults):
+        self._entries[text] = results
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
 
+    def stats(self) -> str:
+        return (f'{self.hits} hits, {self.misses} misses; evaluated {self.evaluations} rules, '
+                f'reused {self.reused} results')
+
+
+@dataclass
+class _CullState:
+    rules: RuleSet
+    debug: bool
+    store: Optional[RevisionStore]
+    cache: Optional[CullCache]
+    preprocess_cache: Optional[PreprocessCache]
+    multiset_delta: bool
+    lines: Optional[_LineCache]
+    profiler: Optional[RuleProfiler] = None
+
+    @classmethod
+    def open(
+        cls,
+        rules_path: Path,
+        debug: bool,
+        store_root: Optional[Path],
+        cache_path: Optional[Path],
+        preprocess_options: PreprocessCacheOptions,
+        multiset_delta: bool,
+        line_cache_entries: int,
+    ) -> _CullState:
+        preprocess_cache = None
+        if preprocess_options.disk_path:
+            preprocess_cache = PreprocessCache(
+                preprocess_options.disk_path, preprocess_options.disk_max_bytes)
+        configure_preprocess_cache(preprocess_options.maxsize, preprocess_cache)
+        return cls(
+            rules=RuleSet.load(rules_path),
+            debug=debug,
+            store=open_store(store_root) if store_root else None,
+            cache=CullCache(cache_path) if cache_path else None,
+            preprocess_cache=preprocess_cache,
+            multiset_delta=multiset_delta,
+            lines=_LineCache(line_cache_entries) if line_cache_entries > 0 else None,
+        )
+
+    def close(self):
+        if self.store:
+            self.store.close()
+        if self.cache:
+            self.cache.close()
+        if self.preprocess_cache:
+            self.preprocess_cache.close()
+
+_worker_state: Optional[_CullState] = None
+
+def _init_worker(*args):
+    global _worker_state
+    _worker_state = _CullState.open(*args)
+    # Closed as the worker exits, so what its caches hold back is written out
+    multiprocessing.util.Finalize(None, _worker_state.close, exitpriority=0)
+
+def _cull_worker(edit: Edit) -> Tuple[Optional[Delta], bool, List[CacheEntry]]:
+    return _try_cull_edit(edit, _worker_state)
+
+def _try_cull_edit(
+    edit: Edit,
+    state: _CullState,
+) -> Tuple[Optional[Delta], bool, List[CacheEntry]]:
+    try:
+        _cull_edit(edit, state)
+    except BrokenPipeError:
+        raise
+    except Exception:
+        logging.exception(f'Failed to cull edit: {edit}')
+        ok = False
+    else:
+        ok = True
+    # New cache entries are written by the main process, which owns the cache for writing
+    return edit.delta, ok, state.cache.take_new() if state.cache else []
+
+def _cull_edit(edit: Edit, state: _CullState):
+    rules, debug, store = state.rules, state.debug, state.store
+    if edit.delta and edit.delta.multiset == state.multiset_delta:
+        # Precomputed by build_edits
+        lines = [Line(index=line.index, raw=line.raw, text=line.text)
+                 for line in edit.delta.lines]
+    else:
+        # Deltas precomputed in the other mode are recomputed rather than culled as they are
+        before, after = edit.before.get_raw(store), edit.after.get_raw(store)
+        lines = Delta.between(before, after, state.multiset_delta).lines
+    edit.delta = Delta(lines=lines, multiset=state.multiset_delta)
+
+    profiler = state.profiler
     rule_counts = {}
     for line in lines:
-        for item in rules['whitelist']:
-            if item in line.text:
-                if debug:
-                    logging.info(f'whitelist match for {item!r} against text {line.text!r}')
-                line.text = line.text.replace(item, '')
-                line.rules.append(CullRule('whitelist', item))
-
-        for name, rule in rules['rules'].items():
-            if cull := _match_rule(line, name, rule, debug):
-                if name in rule_counts and 'max' in rule and rule_counts[name] >= rule['max']:
+        results = state.lines.get(line.text) if state.lines else None
+        if results is None:
+            if profiler:
+                text, items = profiler.apply_whitelist(rules.whitelist, line.text, debug)
+            else:
+                text, items = rules.whitelist.apply(line.text, debug)
+            results = _LineResults(text, items, {})
+            if state.lines:
+                state.lines.put(line.text, results)
+        line.text = results.text
+        line.rules.extend(CullRule('whitelist', item) for item in results.items)
+
+        match = _line_matcher(results, state)
+        for rule in rules.rules:
+            if cull := match(rule):
+                if rule.name in rule_counts and rule.max is not None and \
+                        rule_counts[rule.name] >= rule.max:
+                    if profiler:
+                        profiler.capped(rule)
                     continue
                 line.rules.append(cull)
                 line.culled = True
-                rule_counts.setdefault(name, 0)
-                rule_counts[name] += 1
+                rule_counts.setdefault(rule.name, 0)
+                rule_counts[rule.name] += 1
                 break
 
-    if verbose:
-        print(f'Case page {edit.casepage} > {edit.section} > [[{edit.page}]] > {edit.diff}:')
-        if edit.culled:
-            print(f'  {Fore.GREEN}✓ fully culled: {len(edit.delta.lines)} lines{Fore.RESET}')
-        else:
-            num_culled = sum(1 for line in edit.delta.lines if line.culled)
-            print(f'  {num_culled}/{len(edit.delta.lines)} lines culled')
-        print()
-        for line in lines:
-            if hide_culled and line.culled:
-                continue
-            print(line)
-        print()
+def _line_matcher(
+    results: _LineResults,
+    state: _CullState,
+) -> Callable[[Rule], Optional[CullRule]]:
+    # Only evaluates rules that haven't been tried on the line yet, setting up the rule cache
+    # lookup once one is needed
+    evaluate = None
 
-def _strip_line(text: str) -> str:
-    return text.strip().replace('\u200e', '')
+    def match(rule: Rule) -> Optional[CullRule]:
+        nonlocal evaluate
+        if rule.name in results.rules:
+            state.lines.reused += 1
+            return results.rules[rule.name]
+        if evaluate is None:
+            if state.cache:
+                evaluate = state.cache.matcher(results.text, state.debug)
+            else:
+                evaluate = functools.partial(_match_rule, text=results.text, debug=state.debug)
+            if state.profiler:
+                evaluate = state.profiler.wrap(evaluate)
+        cull = results.rules[rule.name] = evaluate(rule)
+        if state.lines:
+            state.lines.evaluations += 1
+        return cull
 
-def _match_rule(line: Line, name: str, rule: dict, debug: bool) -> Optional[CullRule]:
-    if rule['type'] == 'regex':
-        return _match_regex(line, name, rule, debug)
-    if rule['type'] == 'refs':
-        return _match_refs(line, name, rule)
-    raise NotImplementedError(rule['type'])
+    return match
 
-def _match_regex(line: Line, name: str, rule: dict, debug: bool) -> Optional[CullRule]:
-    if 'pre' in rule:
-        text = _preprocess_wikitext(rule['pre'], line.text)
-    else:
-        text = line.text
-    if 'sub' in rule:
-        for pat, repl in rule['sub']:
-            text = re.sub(pat, repl, text)
-    patterns = [rule['match']] if isinstance(rule['match'], str) else rule['match']
-    if 'flags' in rule:
-        raw_flags = [rule['flags']] if isinstance(rule['flags'], str) else rule['flags']
-        flags = functools.reduce(operator.or_, [re.RegexFlag[flag] for flag in raw_flags])
-    else:
-        flags = re.IGNORECASE
-    for pattern in patterns:
-        if debug:
-            logging.info(f'try pattern {pattern!r} against text {text!r}')
-        if re.fullmatch(pattern, text, flags=flags):
-            return CullRule(name, f'regex match: {pattern}')
-    return None
-
-@functools.cache
-def _preprocess_wikitext(mode: str, text: str) -> str:
-    tree = mwparserfromhell.parse(text)
-
-    if mode == 'strip':
-        _strip_links(tree)
-        _strip_tags(tree)
-    elif mode == 'deref':
-        for tag in tree.filter_tags():
-            if tag.tag == 'ref':
-                _strip_links(tree)
-        _strip_tags(tree)
-    elif mode == 'deextlink':
-        _strip_ext_links(tree)
+def _match_rule(rule: Rule, text: str, debug: bool) -> Optional[CullRule]:
+    return rule.match(text, debug)
+
+def _print_edit(edit: Edit, hide_culled: bool):
+    print(f'Case page {edit.casepage} > {edit.section} > [[{edit.page}]] > {edit.diff}:')
+    if edit.culled:
+        print(f'  {Fore.GREEN}✓ fully culled: {len(edit.delta.lines)} lines{Fore.RESET}')
     else:
-        raise NotImplementedError(mode)
-
-    return re.sub(r'\s+', ' ', str(tree))
-
-def _strip_links(tree: mwparserfromhell.wikicode.Wikicode):
-    _strip_templates(tree)
-    _strip_wikilinks(tree)
-    _strip_ext_links(tree)
-
-def _strip_templates(tree: mwparserfromhell.wikicode.Wikicode, threshold: int = 30):
-    for template in tree.filter_templates(recursive=tree.RECURSE_OTHERS):
-        for param in reversed(template.params):
-            if len(param.name) < threshold and len(param.value) < threshold:
-                template.remove(param)
-        if not template.params and len(template.name) < threshold:
-            _tree_remove(tree, template)
-
-def _strip_wikilinks(tree: mwparserfromhell.wikicode.Wikicode, threshold: int = 50):
-    for link in tree.filter_wikilinks():
-        if len(link.title) < threshold and (link.text is None or len(link.text) < threshold):
-            _tree_remove(tree, link)
-
-def _strip_ext_links(tree: mwparserfromhell.wikicode.Wikicode,
-                     threshold: int = 250, url_threshold: int = 1000):
-    for link in tree.filter_external_links():
-        if len(link.url) < url_threshold and (link.title is None or len(link.title) < threshold):
-            _tree_remove(tree, link)
-
-def _strip_tags(tree: mwparserfromhell.wikicode.Wikicode, threshold: int = 200):
-    for tag in tree.filter_tags():
-        if tag.tag != 'ref' and not tag.attributes:
-            tree.replace(tag, tag.contents)
-
-    for tag in tree.filter_tags():
-        if tag.tag == 'ref' and len(tag.contents) < threshold:
-            _tree_remove(tree, tag)
-
-def _tree_remove(tree: mwparserfromhell.wikicode.Wikicode, node: mwparserfromhell.nodes.Node):
-    try:
-        tree.remove(node)
-    except ValueError:
-        pass
-
-def _match_refs(line: Line, name: str, rule: dict, threshold: int = 30) -> Optional[CullRule]:
-    if not line.text.startswith('*'):
-        return None
-    text = _preprocess_wikitext('strip', line.text.lower())
-    for journal in rule['journals']:
-        if journal in text:
-            for title in rule['titles']:
-                if title in text:
-                    if len(text.replace(journal, '').replace(title, '')) < threshold:
-                        return CullRule(name, 'bibliography match')
-    return None
+        num_culled = sum(1 for line in edit.delta.lines if line.culled)
+        print(f'  {num_culled}/{len(edit.delta.lines)} lines culled')
+    print()
+    for line in edit.delta.lines:
+        if hide_culled and line.culled:
+            continue
+        print(line)
+    print()
 
 def main():
     parser = argparse.ArgumentParser(description='Cull diffs for CCI')
@@ -265,6 +413,8 @@ def main():
                       help='Examine these page(s)')
     filt.add_argument('-d', '--diff', dest='diffs', metavar='REVID', action='append', type=int,
                       help='Examine these diff(s)')
+    parser.add_argument('--multiset-delta', action='store_true',
+                        help='Count repeated copies of an existing line as added')
     outp = parser.add_argument_group('output')
     outp.add_argument('-b', '--batch', metavar='NAME', required=True, help='Batch number or name')
     outp.add_argument('-v', '--verbose', action='store_true', help='Show details')
@@ -272,6 +422,23 @@ def main():
     outp.add_argument('-a', '--all', action='store_true', help='Include unculled diffs in output')
     outp.add_argument('--hide-culled', action='store_true', help='Hide culled lines')
     outp.add_argument('--dump-rules', action='store_true', help='Dump matched rule info')
+    outp.add_argument('--profile-rules', action='store_true',
+                      help='Time each rule and save the results to cull/rules-profile.json; '
+                           'disables the rule cache and runs in one process')
+    parser.add_argument('-w', '--workers', metavar='N', type=int, default=1,
+                        help='Number of processes to cull with')
+    cache = parser.add_argument_group('caching')
+    cache.add_argument('--no-cache', action='store_true',
+                       help="Don't reuse or save rule results from previous runs")
+    cache.add_argument('--preprocess-cache-entries', metavar='N', type=int, default=100_000,
+                       help='Preprocessed lines to keep in memory')
+    cache.add_argument('--line-cache-entries', metavar='N', type=int, default=100_000,
+                       help='Distinct lines to keep rule results for while culling; 0 to '
+                            'evaluate every line of every diff')
+    cache.add_argument('--preprocess-cache-size', metavar='MB', type=int, default=1024,
+                       help='Size limit of the on-disk preprocessing cache')
+    cache.add_argument('--no-preprocess-cache', action='store_true',
+                       help="Don't keep preprocessed lines on disk between runs")
     args = parser.parse_args()
     utils.setup_logging()
 
@@ -283,7 +450,7 @@ def main():
         diffs=args.diffs,
     )
     cull_diffs(
-        root / 'edits.json.gz', root / 'rules.yaml', root / 'cull',
+        find_edits(root), root / 'rules.yaml', root / 'cull',
         filters=filters,
         batch=args.batch,
         verbose=args.verbose,
@@ -291,6 +458,17 @@ def main():
         include_all=args.all,
         hide_culled=args.hide_culled,
         dump_rules=args.dump_rules,
+        workers=args.workers,
+        store_root=root,
+        cache_path=None if args.no_cache else root / 'cull' / 'cache.db',
+        preprocess_cache=PreprocessCacheOptions(
+            maxsize=args.preprocess_cache_entries,
+            disk_path=None if args.no_preprocess_cache else utils.cache_dir() / 'preprocess.db',
+            disk_max_bytes=args.preprocess_cache_size << 20,
+        ),
+        multiset_delta=args.multiset_delta,
+        profile_path=root / 'cull' / 'rules-profile.json' if args.profile_rules else None,
+        line_cache_entries=args.line_cache_entries,
     )
 
 if __name__ == '__main__':
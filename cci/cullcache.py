@@ -0,0 +1,69 @@
+import hashlib
+from pathlib import Path
+import sqlite3
+from typing import Callable, List, Optional, Tuple
+
+from .case import CullRule
+from .rules import Rule
+
+# (text hash, rule fingerprint, matched, detail)
+CacheEntry = Tuple[bytes, str, int, Optional[str]]
+
+class CullCache:
+    # Persistent rule results keyed by (line text hash, rule fingerprint). Since a rule's
+    # fingerprint changes whenever its definition does, a re-run only evaluates rules that were
+    # added or modified, and only on the lines that reach them.
+    def __init__(self, path: Path, commit_every: int = 5000):
+        self.path = path
+        self.commit_every = commit_every
+        self.num_evaluated = 0
+        self._uncommitted = 0
+        self._new: List[CacheEntry] = []
+        self._conn = sqlite3.connect(path, timeout=60)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                text BLOB, rule TEXT, matched INTEGER, detail TEXT,
+                PRIMARY KEY (text, rule)
+            ) WITHOUT ROWID
+        """)
+        self._conn.commit()
+
+    def matcher(self, text: str, debug: bool = False) -> Callable[[Rule], Optional[CullRule]]:
+        key = hashlib.blake2b(text.encode(), digest_size=16).digest()
+        known = {
+            rule: (matched, detail) for rule, matched, detail in self._conn.execute(
+                'SELECT rule, matched, detail FROM results WHERE text = ?', (key,))
+        }
+
+        def match(rule: Rule) -> Optional[CullRule]:
+            if rule.fingerprint in known:
+                matched, detail = known[rule.fingerprint]
+                return CullRule(rule.name, detail) if matched else None
+            cull = rule.match(text, debug)
+            known[rule.fingerprint] = (bool(cull), cull.detail if cull else None)
+            self._new.append((key, rule.fingerprint, *known[rule.fingerprint]))
+            return cull
+
+        return match
+
+    def take_new(self) -> List[CacheEntry]:
+        entries, self._new = self._new, []
+        return entries
+
+    def store(self, entries: List[CacheEntry]):
+        self._conn.executemany(
+            'INSERT OR REPLACE INTO results (text, rule, matched, detail) VALUES (?, ?, ?, ?)',
+            entries)
+        self.num_evaluated += len(entries)
+        self._uncommitted += len(entries)
+        if self._uncommitted >= self.commit_every:
+            self.flush()
+
+    def flush(self):
+        self._conn.commit()
+        self._uncommitted = 0
+
+    def close(self):
+        self.flush()
+        self._conn.close()
@@ -0,0 +1,24 @@
+from collections import Counter
+from typing import List, Tuple
+
+def added_lines(before: str, after: str, multiset: bool = False) -> List[Tuple[int, str]]:
+    # Non-blank lines of after that aren't in before, with their 1-based line numbers in after.
+    # Lines are compared by hash, so before's lines can be dropped as soon as they're hashed,
+    # and moved lines count as unchanged. With multiset, each line in before only accounts for
+    # one identical line in after, so extra copies of a duplicated line count as added.
+    if multiset:
+        counts = Counter(map(hash, before.splitlines()))
+        result = []
+        for i, line in enumerate(after.splitlines(), 1):
+            key = hash(line)
+            if counts[key] > 0:
+                counts[key] -= 1
+            elif line.strip():
+                result.append((i, line))
+        return result
+
+    seen = set(map(hash, before.splitlines()))
+    return [
+        (i, line) for i, line in enumerate(after.splitlines(), 1)
+        if line.strip() and hash(line) not in seen
+    ]
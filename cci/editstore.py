@@ -0,0 +1,191 @@
+from __future__ import annotations
+from dataclasses import dataclass
+import gzip
+import json
+import logging
+import os
+from pathlib import Path
+import sqlite3
+from typing import BinaryIO, Iterator, List, Optional
+
+from .case import Edit, dump_edit, read_edits
+
+@dataclass
+class Filters:
+    casepages: Optional[List[str]]
+    sections: Optional[List[str]]
+    pages: Optional[List[str]]
+    diffs: Optional[List[int]]
+
+    def match(self, edit: Edit) -> bool:
+        for filt, attr in [
+            (self.casepages, edit.casepage),
+            (self.sections, edit.section),
+            (self.pages, edit.page),
+            (self.diffs, edit.diff),
+        ]:
+            if filt is not None and attr not in filt:
+                return False
+        return True
+
+
+class EditWriter:
+    # Writes edits.jsonl.gz as a series of independently compressed gzip members. Concatenated,
+    # they're still one gzip'd file of JSON lines, but an index next to it records which member
+    # holds each edit, so a filtered load only decompresses the members it needs. Both are
+    # written next to their final paths and only put in place once every edit is written.
+    def __init__(self, path: Path, block_bytes: int = 1 << 20):
+        self.path = path
+        self.block_bytes = block_bytes
+        self._tmp_path = path.with_name(path.name + '.tmp')
+        self._fp: BinaryIO = self._tmp_path.open('wb')
+        tmp_index_path = _index_path(self._tmp_path)
+        tmp_index_path.unlink(missing_ok=True)
+        self._index = sqlite3.connect(tmp_index_path)
+        self._index.executescript(_SCHEMA)
+        self._block: List[str] = []
+        self._block_size = 0
+        self._num_blocks = 0
+        self._num_edits = 0
+
+    def write(self, edit: Edit):
+        self._index.execute(
+            'INSERT INTO edits VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (self._num_edits, edit.casepage, edit.section, edit.page, edit.diff,
+             self._num_blocks, len(self._block)),
+        )
+        record = dump_edit(edit)
+        self._block.append(record)
+        self._block_size += len(record)
+        self._num_edits += 1
+        if self._block_size >= self.block_bytes:
+            self._flush_block()
+
+    def _flush_block(self):
+        if not self._block:
+            return
+        offset = self._fp.tell()
+        self._fp.write(gzip.compress(''.join(self._block).encode()))
+        self._index.execute('INSERT INTO blocks VALUES (?, ?, ?)',
+                            (self._num_blocks, offset, self._fp.tell() - offset))
+        self._num_blocks += 1
+        self._block = []
+        self._block_size = 0
+
+    def close(self, ok: bool = True):
+        tmp_index_path = _index_path(self._tmp_path)
+        if not ok:
+            self._fp.close()
+            self._index.close()
+            self._tmp_path.unlink()
+            tmp_index_path.unlink()
+            return
+        self._flush_block()
+        if not self._num_blocks:
+            self._fp.write(gzip.compress(b''))
+        self._fp.close()
+        # The index is only trusted for the exact file it was written with. Renaming keeps the
+        # file's size and mtime.
+        stat = self._tmp_path.stat()
+        self._index.executemany('INSERT INTO meta VALUES (?, ?)', [
+            ('format', _FORMAT),
+            ('size', str(stat.st_size)),
+            ('mtime_ns', str(stat.st_mtime_ns)),
+        ])
+        self._index.commit()
+        self._index.close()
+        os.replace(self._tmp_path, self.path)
+        os.replace(tmp_index_path, _index_path(self.path))
+
+    def __enter__(self) -> EditWriter:
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(ok=exc_type is None)
+
+
+_FORMAT = 'jsonl'
+_SCHEMA = """
+    CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+    CREATE TABLE edits (
+        pos INTEGER PRIMARY KEY,
+        casepage TEXT NOT NULL,
+        section TEXT NOT NULL,
+        page TEXT NOT NULL,
+        diff INTEGER NOT NULL,
+        block INTEGER NOT NULL,
+        item INTEGER NOT NULL
+    );
+    CREATE INDEX edits_diff ON edits (diff);
+    CREATE INDEX edits_page ON edits (page);
+    CREATE TABLE blocks (block INTEGER PRIMARY KEY, offset INTEGER, length INTEGER);
+"""
+
+def _index_path(path: Path) -> Path:
+    return path.with_name(path.name + '.idx')
+
+def find_edits(root: Path) -> Path:
+    # Cases built before edits were stored as JSON lines have edits.json.gz instead
+    path = root / 'edits.jsonl.gz'
+    legacy = root / 'edits.json.gz'
+    return legacy if legacy.exists() and not path.exists() else path
+
+def iter_edits(path: Path, filters: Optional[Filters] = None) -> Iterator[Edit]:
+    # Only reads the edits that match filters, using the index when there is an up to date one
+    if filters is not None:
+        positions = _lookup(path, filters, 'edits.block, offset, length, item')
+        if positions is not None:
+            yield from _iter_blocks(path, positions)
+            return
+        logging.info(f'no usable index for {path}; reading every edit')
+    with gzip.open(path, 'rt') as fp:
+        for edit in read_edits(fp):
+            if filters is None or filters.match(edit):
+                yield edit
+
+def count_edits(path: Path, filters: Optional[Filters] = None) -> Optional[int]:
+    # None if there's no index to count with
+    result = _lookup(path, filters or Filters(None, None, None, None), 'COUNT(*)')
+    return result[0][0] if result is not None else None
+
+def _lookup(path: Path, filters: Filters, columns: str) -> Optional[List[tuple]]:
+    # Returns columns for each matching edit, in file order
+    index_path = _index_path(path)
+    if not index_path.exists():
+        return None
+    conn = sqlite3.connect(f'{index_path.as_uri()}?mode=ro', uri=True)
+    try:
+        meta = dict(conn.execute('SELECT key, value FROM meta'))
+        stat = path.stat()
+        if meta != {
+            'format': _FORMAT, 'size': str(stat.st_size), 'mtime_ns': str(stat.st_mtime_ns),
+        }:
+            return None
+        where = []
+        params: list = []
+        for column, filt in [
+            ('casepage', filters.casepages),
+            ('section', filters.sections),
+            ('page', filters.pages),
+            ('diff', filters.diffs),
+        ]:
+            if filt is not None:
+                where.append(f"edits.{column} IN ({', '.join('?' * len(filt))})")
+                params += filt
+        return conn.execute(
+            f'SELECT {columns} FROM edits JOIN blocks ON edits.block = blocks.block '
+            f"WHERE {' AND '.join(where) or '1'} ORDER BY pos",
+            params,
+        ).fetchall()
+    finally:
+        conn.close()
+
+def _iter_blocks(path: Path, positions: List[tuple]) -> Iterator[Edit]:
+    block_id = lines = None
+    with path.open('rb') as fp:
+        for cur_id, offset, length, item in positions:
+            if cur_id != block_id:
+                fp.seek(offset)
+                lines = gzip.decompress(fp.read(length)).decode().split('\n')
+                block_id = cur_id
+            yield Edit.load(json.loads(lines[item]))
@@ -5,21 +5,36 @@ import logging
 import math
 from pathlib import Path
 import re
-from typing import List, Optional
+from typing import List, Optional, Sequence, Tuple
 
 import mwparserfromhell
 import tqdm
 
 from . import utils
 from .case import Case, CasePage, Diff, Page, Section
+from .casestore import save_case
 
 _IGNORED_HEADINGS = ['Instructions', 'Background', 'Contribution survey']
 
-def fetch_cci(name: str, recursive: bool = True) -> Case:
+# A line as the contribution surveyor writes it, e.g.
+#   *'''N''' [[:Title]] (2 edits): [[Special:Diff/123|(+456)]][[Special:Diff/789|(-10)]]
+# Outside of its links the line has no markup that could hide, split or add a link, so they can
+# be read straight from the text. Titles start with a colon, so they can't be taken for URLs,
+# and can't have bold or italics in them.
+_PLAIN = r'[^\[\]{}<>]*'
+_REPORT_LINE = re.compile(
+    rf"\*{_PLAIN}\[\[(:(?:[^\[\]{{}}<>|']|'(?!'))+)\]\]"
+    rf'((?:{_PLAIN}\[\[Special:Diff/\d+\|\([+-]\d+\)\]\])*){_PLAIN}'
+)
+_REPORT_DIFF = re.compile(r'\[\[Special:Diff/(\d+)\|\(([+-]\d+)\)\]\]')
+# Stands in for report lines while the rest of a case page is parsed
+_PLACEHOLDER = '\ue000'
+
+def fetch_cci(name: str, recursive: bool = True, jobs: int = 1) -> Case:
     title = utils.CCI_PREFIX + name
     logging.info('fetching main case page')
     content = utils.get_title_content(title)
-    tree = mwparserfromhell.parse(content)
+    tree, runs = _parse_page(content)
 
     subpages: List[str] = sorted(
         link.title for link in tree.filter_wikilinks()
@@ -32,19 +47,20 @@ def fetch_cci(name: str, recursive: bool = True) -> Case:
         numlen = math.ceil(math.log10(len(subpages)))
         firstname = '1'.zfill(numlen)
         assert firstname not in indices, indices
-        trees = {firstname: tree}
+        trees = {firstname: (tree, runs)}
         logging.info('fetching case subpages...')
-        for index, subtitle in tqdm.tqdm(indices.items(), unit='pages'):
-            subcontent = utils.get_title_content(subtitle)
-            trees[index] = mwparserfromhell.parse(subcontent)
+        contents = utils.parallel_map(utils.get_title_content, indices.values(), jobs)
+        contents = tqdm.tqdm(contents, total=len(indices), unit='pages')
+        for index, subcontent in zip(indices, contents):
+            trees[index] = _parse_page(subcontent)
     else:
-        trees = {'main': tree}
+        trees = {'main': (tree, runs)}
 
     logging.info('parsing cases...')
     pages = {}
-    for index, tree in tqdm.tqdm(trees.items(), unit='pages'):
+    for index, (tree, runs) in tqdm.tqdm(trees.items(), unit='pages'):
         try:
-            page = _parse_case_page(index, name, tree)
+            page = _parse_case_page(index, name, tree, runs)
         except Exception:
             logging.error(f'failed to parse case page {index}')
             raise
@@ -54,35 +70,76 @@ def fetch_cci(name: str, recursive: bool = True) -> Case:
 
     return Case(pages)
 
-def _parse_case_page(index: str, name: str,
-                     tree: mwparserfromhell.wikicode.Wikicode) -> Optional[CasePage]:
+def _parse_page(content: str) -> Tuple[mwparserfromhell.wikicode.Wikicode, List[List[str]]]:
+    # Most of a big case page is report lines, and building a tree of all their links takes far
+    # longer than reading them, so the page is parsed with a placeholder for each run of them.
+    # The lines are put back when sections are split into lines. They can't open or close
+    # anything around them, so the page parses the same unless a placeholder ends up inside
+    # some other markup, in which case the page is parsed as it is.
+    lines = []
+    runs: List[List[str]] = []
+    if _PLACEHOLDER not in content:
+        for line in content.splitlines(keepends=True):
+            text = line.splitlines()[0]
+            if not (text.startswith('*') and text == text.strip() and
+                    _REPORT_LINE.fullmatch(text)):
+                lines.append(line)
+            elif lines and lines[-1].startswith(f'*{_PLACEHOLDER}'):
+                runs[-1].append(text)
+                lines[-1] = f'*{_PLACEHOLDER}{len(runs) - 1}{line[len(text):]}'
+            else:
+                runs.append([text])
+                lines.append(f'*{_PLACEHOLDER}{len(runs) - 1}{line[len(text):]}')
+    if runs:
+        tree = mwparserfromhell.parse(''.join(lines))
+        found = sum(str(node).count(_PLACEHOLDER) for node in tree.nodes
+                    if isinstance(node, mwparserfromhell.nodes.Text))
+        if found == len(runs):
+            return tree, runs
+    return mwparserfromhell.parse(content), []
+
+def _parse_case_page(index: str, name: str, tree: mwparserfromhell.wikicode.Wikicode,
+                     runs: Sequence[List[str]] = ()) -> Optional[CasePage]:
     diff_sections = tree.get_sections(matches=lambda title: title.matches(name))
     if not diff_sections and '<!-- Template:Courtesy blanked -->' in tree:
         return None
     assert len(diff_sections) == 1, tree.filter_headings()
     diff_section = diff_sections[0]
-    assert diff_section.nodes[0].level == 2
+    assert _heading(diff_section).level == 2
 
-    excluded = [diff_section]
+    # Sections share their nodes with the tree, so one is inside another if its heading is.
+    # (Comparing sections with `in` compares their text, which is slow for big case pages.)
+    excluded = set()
+
+    def exclude(section: mwparserfromhell.wikicode.Wikicode):
+        excluded.update(map(id, section.filter_headings(recursive=False)))
+
+    exclude(diff_section)
     unknown = []
     for section in tree.get_sections(include_lead=False):
-        if any(section in excl for excl in excluded):
+        if id(_heading(section)) in excluded:
             continue
-        if section.nodes[0].title.matches(_IGNORED_HEADINGS):
-            excluded.append(section)
+        if _heading(section).title.matches(_IGNORED_HEADINGS):
+            exclude(section)
         else:
             unknown.append(section)
 
-    unknown = [section for section in unknown if not any(section in excl for excl in excluded)]
-    assert not unknown, [section.nodes[0] for section in unknown]
+    unknown = [section for section in unknown if id(_heading(section)) not in excluded]
+    assert not unknown, [_heading(section) for section in unknown]
 
     sections = {}
     for section in diff_section.get_sections(levels=[3]):
-        title = section.nodes[0].title.strip()
+        title = _heading(section).title.strip()
         match = re.match(r'^Pages (\d+) through (\d+)$', title)
         assert match, title
         index = f'{match.group(1)}-{match.group(2)}'
-        lines = [line.strip() for line in section.splitlines()[1:] if line.strip()]
+        lines = []
+        for line in section.splitlines()[1:]:
+            line = line.strip()
+            if line.startswith(f'*{_PLACEHOLDER}'):
+                lines += runs[int(line[2:])]
+            elif line:
+                lines.append(line)
         if _is_collapsed(lines):
             continue
         pages = [_parse_line(line) for line in lines]
@@ -93,6 +150,10 @@ def _parse_case_page(index: str, name: str,
 
     return CasePage(index, sections)
 
+def _heading(section: mwparserfromhell.wikicode.Wikicode) -> mwparserfromhell.nodes.Heading:
+    # section.nodes[0] would copy every node of the page first, since sections are slices of it
+    return next(iter(section.nodes))
+
 def _is_collapsed(lines: List[str]) -> bool:
     if not lines:
         return False
@@ -107,6 +168,17 @@ def _is_collapsed(lines: List[str]) -> bool:
 def _parse_line(line: str) -> Optional[Page]:
     if not line.startswith('*'):
         return None
+    match = _REPORT_LINE.fullmatch(line)
+    if not match:
+        # Anything else, like lines with review templates or comments, is left to the parser
+        return _parse_line_tree(line)
+    return Page(
+        title=match.group(1).lstrip(':'),
+        diffs=[Diff(revid=int(revid), size=int(size))
+               for revid, size in _REPORT_DIFF.findall(match.group(2))],
+    )
+
+def _parse_line_tree(line: str) -> Optional[Page]:
     tree = mwparserfromhell.parse(line)
     if any(tmpl.name.matches(('Y', 'N', '?')) for tmpl in tree.filter_templates()):
         return None
@@ -130,7 +202,7 @@ def _parse_diff(link: mwparserfromhell.nodes.Wikilink) -> Diff:
 
     return Diff(
         revid=int(revid),
-        size=size[1:-1],
+        size=int(size[1:-1]),
     )
 
 def main():
@@ -139,17 +211,21 @@ def main():
     parser.add_argument('-o', '--output', help='Case output dir', required=True)
     parser.add_argument('--no-recursive', action='store_true',
                         help='Only process the top-level case page')
+    parser.add_argument('-j', '--jobs', metavar='N', type=int, default=1,
+                        help='Number of subpages to download at once')
+    parser.add_argument('--store', choices=['sqlite', 'json'], default='sqlite',
+                        help='Save the case as case.db or as JSON files in case/ '
+                             '(default: sqlite)')
     args = parser.parse_args()
     utils.setup_logging()
 
     root = Path(args.output)
-    case_dir = root / 'case'
-    case_dir.mkdir(parents=True, exist_ok=True)
+    root.mkdir(parents=True, exist_ok=True)
 
-    case = fetch_cci(args.name, recursive=not args.no_recursive)
+    case = fetch_cci(args.name, recursive=not args.no_recursive, jobs=args.jobs)
 
     logging.info('saving')
-    case.save(case_dir)
+    save_case(root, case, args.store)
 
 if __name__ == '__main__':
     main()
@@ -1,39 +1,60 @@
 #!/usr/bin/env python3
 
 import argparse
-import gzip
-import json
 import logging
 from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
 
 import tqdm
 
 from . import site, utils
 from .case import Case
+from .casestore import CaseStore, load_case
+from .revstore import RevisionCache, RevisionStore, open_cache, open_store
 
-def fetch_diffs(case_dir: Path, rev_dir: Path):
-    case = Case.load(case_dir)
-
+def fetch_diffs(
+    case: Union[Case, CaseStore],
+    store: RevisionStore,
+    batch_size: int = 50,
+    jobs: int = 1,
+    cache: Optional[RevisionCache] = None,
+):
     logging.info('fetching case diffs...')
-    revids = [
-        (page.title, diff.revid)
-        for casepage in case.pages.values()
-        for section in casepage.sections.values()
-        for page in section.pages
-        for diff in page.diffs
-    ]
-
-    for title, revid in tqdm.tqdm(revids, unit='revs'):
-        path = rev_dir / f'{revid}.json.gz'
-        if path.exists():
-            continue
-
-        for revid, content in _fetch_diff(title, revid).items():
-            path = rev_dir / f'{revid}.json.gz'
-            if path.exists():
+    revids = [(page.title, diff.revid) for _, _, page, diff in case.iter_diffs()]
+
+    if batch_size > 0:
+        _fetch_batched(store, revids, batch_size, jobs, cache)
+        return
+
+    def todo():
+        for title, revid in tqdm.tqdm(revids, unit='revs'):
+            if revid in store:
                 continue
-            with gzip.open(path, 'wt') as fp:
-                fp.write(json.dumps(content))
+            revs = _diff_from_cache(cache, store, title, revid) if cache else None
+            if revs:
+                store.put_many(revs.items())
+            else:
+                yield title, revid
+
+    for revs in utils.parallel_map(lambda item: _fetch_diff(*item), todo(), jobs):
+        store.put_many(revs.items())
+        if cache:
+            cache.put_many(revs.items())
+    store.flush()
+
+def _diff_from_cache(
+    cache: RevisionCache, store: RevisionStore, title: str, revid: int,
+) -> Optional[Dict[int, dict]]:
+    # A diff's revision and its parent, parent first, if the cache has both. Cached titles are
+    # whatever the page was called when another case fetched it, so the case's title is used.
+    try:
+        rev = {**cache.get(revid), 'title': title}
+        parentid = rev['parentid']
+        if not parentid or parentid in store:
+            return {revid: rev}
+        return {parentid: {**cache.get(parentid), 'title': title}, revid: rev}
+    except KeyError:
+        return None
 
 def _fetch_diff(title: str, revid: int) -> dict:
     gen = site.query(
@@ -57,6 +78,175 @@ def _fetch_diff(title: str, revid: int) -> dict:
     assert revs[0].parentid == 0 or len(revs) == 2, revid
     return {rev.revid: _format_rev(page, rev) for rev in revs}
 
+def _fetch_batched(
+    store: RevisionStore,
+    revids: List[Tuple[str, int]],
+    batch_size: int,
+    jobs: int,
+    cache: Optional[RevisionCache],
+):
+    # Listed revisions are fetched in batches by revid; the parents they need are collected and
+    # fetched in batches of their own. A revision is only written once its parent is stored, so
+    # an interrupted run can be resumed by skipping revisions that already exist.
+    #
+    # When a contributor made several edits in a row, the parent of a listed revision is often
+    # another listed one. Those parents are left to arrive with the listed revisions rather than
+    # being queued too, so no revision is fetched twice.
+    #
+    # Revisions found in the machine-wide cache are treated as if they'd just been fetched, and
+    # fetched ones are added to it.
+    titles = {revid: title for title, revid in revids}
+    listed = set(titles)
+    written = set()
+    pending: Dict[int, dict] = {}
+    wanted: Dict[int, str] = {}
+    parents: Dict[int, int] = {}
+    sizes: Dict[int, int] = {}
+    num_queries = 0
+    num_cached = 0
+    fetched_bytes = 0
+
+    def have(revid: int) -> bool:
+        return revid in written or revid in store
+
+    def add(result: Tuple[Dict[int, dict], int], cached: bool = False):
+        nonlocal num_queries, fetched_bytes
+        revs, queries = result
+        num_queries += queries
+        pending.update(revs)
+        if cache and not cached:
+            cache.put_many(revs.items())
+        for revid, rev in revs.items():
+            wanted.pop(revid, None)
+            if 'content' in rev:
+                sizes[revid] = len(rev['content'].encode())
+                if not cached:
+                    fetched_bytes += sizes[revid]
+            parentid = rev.get('parentid', 0)
+            if revid in listed:
+                parents[revid] = parentid
+            # Listed parents are fetched along with the other listed revisions
+            if (revid in listed and parentid and parentid not in listed
+                    and parentid not in pending and not have(parentid)):
+                wanted[parentid] = rev['title']
+
+    def from_cache(revids: Dict[int, str]) -> Dict[int, str]:
+        # Adds the revisions the cache has, and returns the rest to fetch
+        nonlocal num_cached
+        if cache is None:
+            return revids
+        hits = {}
+        for revid, title in revids.items():
+            try:
+                # The page may have moved since the revision was cached
+                hits[revid] = {**cache.get(revid), 'title': title}
+            except KeyError:
+                pass
+        if hits:
+            num_cached += len(hits)
+            add((hits, 0), cached=True)
+        return {revid: title for revid, title in revids.items() if revid not in hits}
+
+    def fetch_parents(min_size: int):
+        items = list(wanted.items())
+        batches = [
+            from_cache(dict(items[i:i + batch_size]))
+            for i in range(0, len(items) - min_size + 1, batch_size)
+        ]
+        for result in utils.parallel_map(_fetch_revs, batches, jobs):
+            add(result)
+
+    def flush():
+        changed = True
+        while changed:
+            changed = False
+            for revid, rev in list(pending.items()):
+                parentid = rev.get('parentid', 0)
+                if revid not in listed or not parentid or have(parentid):
+                    store.put(revid, rev)
+                    written.add(revid)
+                    del pending[revid]
+                    changed = True
+
+    todo = [revid for revid in titles if not have(revid)]
+    with tqdm.tqdm(total=len(todo), unit='revs') as progress:
+        def chunks():
+            for i in range(0, len(todo), batch_size):
+                chunk = todo[i:i + batch_size]
+                yield from_cache({revid: titles[revid] for revid in chunk
+                                  if revid not in pending and not have(revid)})
+                progress.update(len(chunk))
+
+        for result in utils.parallel_map(_fetch_revs, chunks(), jobs):
+            add(result)
+            if len(wanted) >= batch_size * jobs:
+                fetch_parents(batch_size)
+            flush()
+
+    while wanted:
+        fetch_parents(1)
+    flush()
+    store.flush()
+    assert not pending, list(pending)
+
+    # Compared to fetching each listed revision along with its parent in a query of its own
+    naive_bytes = sum(sizes.get(revid, 0) + sizes.get(parentid, 0)
+                      for revid, parentid in parents.items())
+    logging.info(
+        f'stored {len(written)} revisions ({num_cached} from the revision cache) '
+        f'in {num_queries} queries; saved '
+        f'{len(todo) - num_queries} queries and '
+        f'{(naive_bytes - fetched_bytes) / (1 << 20):.1f} MiB of content'
+    )
+
+def _fetch_revs(revids: Dict[int, str]) -> Tuple[Dict[int, dict], int]:
+    if not revids:
+        return {}, 0
+    result = {}
+    num_queries = 0
+    for resp in site.query(
+        revids=list(revids),
+        prop='revisions',
+        rvprop='content|ids',
+        rvslots='main',
+    ):
+        num_queries += 1
+        for page in resp.get('pages', []):
+            for rev in page.get('revisions', []):
+                if rev.revid in revids:
+                    result[rev.revid] = _format_rev(page, rev)
+
+    bad = {revid: title for revid, title in revids.items() if revid not in result}
+    if bad:
+        missing, queries = _check_missing(bad)
+        result.update(missing)
+        num_queries += queries
+    return result, num_queries
+
+def _check_missing(revids: Dict[int, str]) -> Tuple[Dict[int, dict], int]:
+    # Bad revids don't tell us whether the page or just the revision is gone, so look up the
+    # titles they were listed under to tell the two apart
+    pages = {}
+    aliases = {}
+    num_queries = 0
+    for resp in site.query(titles=sorted(set(revids.values())), prop='info', redirects=1):
+        num_queries += 1
+        for item in resp.get('normalized', []) + resp.get('redirects', []):
+            aliases[item['from']] = item['to']
+        for page in resp.get('pages', []):
+            pages[page.title] = page
+
+    result = {}
+    for revid, title in revids.items():
+        for _ in range(2):
+            title = aliases.get(title, title)
+        page = pages.get(title)
+        if page is None or 'missing' in page or 'invalid' in page:
+            result[revid] = {'title': title, 'missing': 'page'}
+        else:
+            result[revid] = {'title': page.title, 'missing': 'rev'}
+    return result, num_queries
+
 def _format_rev(page, rev) -> dict:
     result = {
         'title': page.title,
@@ -71,17 +261,28 @@ def _format_rev(page, rev) -> dict:
 def main():
     parser = argparse.ArgumentParser(description='Fetch diffs for CCI')
     parser.add_argument('case', help='Case dir')
+    parser.add_argument('--batch-size', metavar='N', type=int, default=50,
+                        help='Revisions to request per query (0 to fetch each diff separately)')
+    parser.add_argument('-j', '--jobs', metavar='N', type=int, default=1,
+                        help='Number of queries to run at once')
+    parser.add_argument('--store', choices=['sqlite', 'dir'],
+                        help='Revision store to create if the case has none (default: sqlite)')
+    parser.add_argument('--no-revision-cache', action='store_true',
+                        help="Don't share revisions with other cases through the revision cache")
+    parser.add_argument('--revision-cache-size', metavar='MB', type=int, default=10240,
+                        help='Size limit of the revision cache')
     args = parser.parse_args()
     utils.setup_logging()
 
     root = Path(args.case)
-    case_dir = root / 'case'
-    rev_dir = root / 'revs'
-    if not case_dir.exists():
-        raise RuntimeError(f'Case dir {case_dir} does not exist; please run fetch_cci first')
-    rev_dir.mkdir(exist_ok=True)
-
-    fetch_diffs(case_dir, rev_dir)
+    case = load_case(root)
+    cache = None if args.no_revision_cache else open_cache(args.revision_cache_size << 20)
+    try:
+        with open_store(root, args.store) as store:
+            fetch_diffs(case, store, batch_size=args.batch_size, jobs=args.jobs, cache=cache)
+    finally:
+        if cache:
+            cache.close()
 
 if __name__ == '__main__':
     main()
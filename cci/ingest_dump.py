@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+import argparse
+import bz2
+import gzip
+import logging
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, List, Optional, Set, Union
+import xml.etree.ElementTree as ET
+
+import tqdm
+
+from . import utils
+from .case import Case
+from .casestore import CaseStore, load_case
+from .revstore import RevisionCache, RevisionStore, open_cache, open_store
+
+def ingest_dump(
+    case: Union[Case, CaseStore],
+    store: RevisionStore,
+    dump_paths: List[Path],
+    partial: bool = False,
+    cache: Optional[RevisionCache] = None,
+):
+    # Stores the case's revisions and their parents from pages-meta-history dumps, in the same
+    # form fetch_diffs does. Only the revision before the current one in each page's history is
+    # kept, which is almost always the parent; a listed revision whose parent can't be found
+    # this way is left for fetch_diffs, which skips revisions already stored.
+    titles = {diff.revid: page.title for _, _, page, diff in case.iter_diffs()}
+    case_titles = set(titles.values())
+    todo = {revid for revid in titles if revid not in store}
+    logging.info(f'looking for {len(todo)} revisions...')
+    seen: Set[int] = set()
+    seen_titles: Set[str] = set()
+    num_stored = 0
+
+    def put(revs: Dict[int, dict]):
+        nonlocal num_stored
+        store.put_many(revs.items())
+        if cache:
+            cache.put_many(revs.items())
+        num_stored += len(revs)
+
+    for path in dump_paths:
+        logging.info(f'reading {path}')
+        with _open_dump(path) as fp:
+            for title, rev, prev in _iter_revisions(fp, todo):
+                if title in case_titles:
+                    seen_titles.add(title)
+                if rev is None:
+                    continue
+                revid = rev.pop('revid')
+                parentid = rev['parentid']
+                seen.add(revid)
+                if not parentid or parentid in store:
+                    put({revid: rev})
+                elif prev and prev['revid'] == parentid and parentid not in titles:
+                    put({parentid: _without_revid(prev), revid: rev})
+                else:
+                    continue
+                todo.discard(revid)
+
+    deferred = todo & seen
+    if deferred:
+        logging.warning(f"{len(deferred)} revisions are left for fetch_diffs, as their parents "
+                        f"weren't the revisions before them or are still to be fetched")
+    missing = todo - seen
+    if missing and not partial:
+        # Like fetch_diffs, tell deleted pages from deleted revisions by whether the title
+        # exists. Moved pages leave a redirect behind, which is in the dump too.
+        put({
+            revid: {'title': titles[revid],
+                    'missing': 'rev' if titles[revid] in seen_titles else 'page'}
+            for revid in missing
+        })
+        logging.info(f'{len(missing)} revisions are missing')
+    store.flush()
+    logging.info(f'stored {num_stored} revisions')
+
+def _without_revid(rev: dict) -> dict:
+    return {key: value for key, value in rev.items() if key != 'revid'}
+
+def _open_dump(path: Path) -> BinaryIO:
+    if path.suffix == '.bz2':
+        return bz2.open(path, 'rb')
+    if path.suffix == '.gz':
+        return gzip.open(path, 'rb')
+    return path.open('rb')
+
+def _iter_revisions(fp: BinaryIO, revids: Set[int]) -> Iterator[tuple]:
+    # Yields (page title, revision, previous revision) for every revision in revids, and
+    # (title, None, None) for every page. Revisions are dicts as stored by fetch_diffs, plus
+    # their revid.
+    root = page = None
+    ns = ''
+    title = None
+    prev: Optional[dict] = None
+    with tqdm.tqdm(unit='pages') as progress:
+        for event, elem in ET.iterparse(fp, events=('start', 'end')):
+            if event == 'start':
+                if root is None:
+                    root = elem
+                    ns = elem.tag[:elem.tag.index('}') + 1] if elem.tag[0] == '{' else ''
+                elif elem.tag == ns + 'page':
+                    page = elem
+                    title = None
+                    prev = None
+                continue
+
+            if elem.tag == ns + 'title':
+                title = elem.text
+            elif elem.tag == ns + 'revision':
+                rev = _format_rev(ns, elem, title, prev)
+                if rev['revid'] in revids:
+                    yield title, dict(rev), prev
+                prev = rev
+                # Drop finished revisions so memory use doesn't grow with the page's history
+                page.clear()
+            elif elem.tag == ns + 'page':
+                yield title, None, None
+                progress.update()
+                root.clear()
+
+def _format_rev(ns: str, elem: ET.Element, title: str, prev: Optional[dict]) -> dict:
+    # Dumps from before MediaWiki 1.21 have no parentids; revisions are in history order, so
+    # the previous one is the parent
+    parentid = elem.findtext(ns + 'parentid')
+    result = {
+        'revid': int(elem.findtext(ns + 'id')),
+        'title': title,
+        'parentid': int(parentid) if parentid else (prev['revid'] if prev else 0),
+    }
+    text = elem.find(ns + 'text')
+    if text is None or text.get('deleted') is not None:
+        result['missing'] = 'content'
+    else:
+        result['content'] = text.text or ''
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Store a case's revisions from pages-meta-history XML dumps")
+    parser.add_argument('case', help='Case dir')
+    parser.add_argument('dumps', nargs='+', type=Path, help='Dump files (.xml, .xml.bz2, .xml.gz)')
+    parser.add_argument('--partial', action='store_true',
+                        help="The dumps don't cover every page, so leave revisions that weren't "
+                             "found for fetch_diffs instead of marking them missing")
+    parser.add_argument('--store', choices=['sqlite', 'dir'],
+                        help='Revision store to create if the case has none (default: sqlite)')
+    parser.add_argument('--no-revision-cache', action='store_true',
+                        help="Don't add the revisions to the revision cache")
+    parser.add_argument('--revision-cache-size', metavar='MB', type=int, default=10240,
+                        help='Size limit of the revision cache')
+    args = parser.parse_args()
+    utils.setup_logging()
+
+    root = Path(args.case)
+    case = load_case(root)
+    cache = None if args.no_revision_cache else open_cache(args.revision_cache_size << 20)
+    try:
+        with open_store(root, args.store) as store:
+            ingest_dump(case, store, args.dumps, partial=args.partial, cache=cache)
+    finally:
+        if cache:
+            cache.close()
+
+if __name__ == '__main__':
+    main()
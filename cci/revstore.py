@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+from pathlib import Path
+import sqlite3
+import time
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+import zlib
+
+import tqdm
+
+from . import utils
+
+class RevisionStore:
+    def __contains__(self, revid: int) -> bool:
+        raise NotImplementedError()
+
+    def __iter__(self) -> Iterator[int]:
+        raise NotImplementedError()
+
+    def get(self, revid: int) -> dict:
+        raise NotImplementedError()
+
+    def put(self, revid: int, rev: dict):
+        self.put_many([(revid, rev)])
+
+    def put_many(self, revs: Iterable[Tuple[int, dict]]):
+        raise NotImplementedError()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self) -> RevisionStore:
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class DirectoryStore(RevisionStore):
+    # The original layout: one revs/<revid>.json.gz file per revision
+    def __init__(self, rev_dir: Path):
+        self.rev_dir = rev_dir
+
+    def _path(self, revid: int) -> Path:
+        return self.rev_dir / f'{revid}.json.gz'
+
+    def __contains__(self, revid: int) -> bool:
+        return self._path(revid).exists()
+
+    def __iter__(self) -> Iterator[int]:
+        for path in self.rev_dir.glob('*.json.gz'):
+            yield int(path.name.split('.', 1)[0])
+
+    def get(self, revid: int) -> dict:
+        try:
+            with gzip.open(self._path(revid), 'rt') as fp:
+                return json.load(fp)
+        except FileNotFoundError:
+            raise KeyError(revid) from None
+
+    def put_many(self, revs: Iterable[Tuple[int, dict]]):
+        for revid, rev in revs:
+            path = self._path(revid)
+            if path.exists():
+                continue
+            with gzip.open(path, 'wt') as fp:
+                fp.write(json.dumps(rev))
+
+
+class SQLiteStore(RevisionStore):
+    # All revisions in one database file, as zlib-compressed JSON keyed by revid. Writes are
+    # committed in batches; a batch is atomic, so revisions are never visible before ones that
+    # were written ahead of them.
+    def __init__(self, path: Path, commit_every: int = 500):
+        self.path = path
+        self.commit_every = commit_every
+        self._uncommitted = 0
+        self._conn = sqlite3.connect(path)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS revs (revid INTEGER PRIMARY KEY, data BLOB)')
+        self._conn.commit()
+
+    def __contains__(self, revid: int) -> bool:
+        cur = self._conn.execute('SELECT 1 FROM revs WHERE revid = ?', (revid,))
+        return cur.fetchone() is not None
+
+    def __iter__(self) -> Iterator[int]:
+        for (revid,) in self._conn.execute('SELECT revid FROM revs ORDER BY revid'):
+            yield revid
+
+    def get(self, revid: int) -> dict:
+        row = self._conn.execute('SELECT data FROM revs WHERE revid = ?', (revid,)).fetchone()
+        if row is None:
+            raise KeyError(revid)
+        return json.loads(zlib.decompress(row[0]))
+
+    def put_many(self, revs: Iterable[Tuple[int, dict]]):
+        rows = [(revid, zlib.compress(json.dumps(rev).encode())) for revid, rev in revs]
+        self._conn.executemany('INSERT OR IGNORE INTO revs (revid, data) VALUES (?, ?)', rows)
+        self._uncommitted += len(rows)
+        if self._uncommitted >= self.commit_every:
+            self.flush()
+
+    def flush(self):
+        self._conn.commit()
+        self._uncommitted = 0
+
+    def close(self):
+        self.flush()
+        self._conn.close()
+
+
+class RevisionCache:
+    # Revisions shared between cases on one machine, since many cases cover the same articles.
+    # Content is stored once per distinct text, keyed by its hash; revisions whose content isn't
+    # available aren't cached, since that can change. Several processes can use the cache at
+    # once, and revisions are evicted least recently used first once it grows past max_bytes.
+    def __init__(self, path: Path, max_bytes: int, check_every: int = 1000):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.check_every = check_every
+        self.hits = 0
+        self._puts = 0
+        # Access times of hits, written together rather than an update per hit
+        self._touched: Dict[int, float] = {}
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS blobs (hash BLOB PRIMARY KEY, data BLOB);
+            CREATE TABLE IF NOT EXISTS revs (
+                revid INTEGER PRIMARY KEY,
+                title TEXT,
+                parentid INTEGER,
+                hash BLOB,
+                size INTEGER,
+                atime REAL
+            );
+            CREATE INDEX IF NOT EXISTS revs_atime ON revs (atime);
+            CREATE INDEX IF NOT EXISTS revs_hash ON revs (hash);
+        """)
+
+    def __contains__(self, revid: int) -> bool:
+        cur = self._conn.execute('SELECT 1 FROM revs WHERE revid = ?', (revid,))
+        return cur.fetchone() is not None
+
+    def get(self, revid: int) -> dict:
+        row = self._conn.execute("""
+            SELECT title, parentid, data FROM revs JOIN blobs ON revs.hash = blobs.hash
+            WHERE revid = ?
+        """, (revid,)).fetchone()
+        if row is None:
+            raise KeyError(revid)
+        self.hits += 1
+        self._touched[revid] = time.time()
+        if len(self._touched) >= self.check_every:
+            self._flush_touched()
+        title, parentid, data = row
+        return {
+            'title': title,
+            'parentid': parentid,
+            'content': zlib.decompress(data).decode(),
+        }
+
+    def put_many(self, revs: Iterable[Tuple[int, dict]]):
+        now = time.time()
+        blobs = {}
+        rows = []
+        for revid, rev in revs:
+            if 'content' not in rev:
+                continue
+            content = rev['content'].encode()
+            key = hashlib.blake2b(content, digest_size=16).digest()
+            blobs[key] = zlib.compress(content)
+            rows.append((revid, rev['title'], rev['parentid'], key, len(blobs[key]), now))
+        if not rows:
+            return
+        with self._conn:
+            self._conn.execute('BEGIN IMMEDIATE')
+            self._conn.executemany('INSERT OR IGNORE INTO blobs VALUES (?, ?)', blobs.items())
+            self._conn.executemany('INSERT OR IGNORE INTO revs VALUES (?, ?, ?, ?, ?, ?)', rows)
+        self._puts += len(rows)
+        if self._puts >= self.check_every:
+            self._puts = 0
+            self.evict()
+
+    def _flush_touched(self):
+        if not self._touched:
+            return
+        with self._conn:
+            self._conn.execute('BEGIN IMMEDIATE')
+            self._conn.executemany('UPDATE revs SET atime = ? WHERE revid = ?',
+                                   [(atime, revid) for revid, atime in self._touched.items()])
+        self._touched = {}
+
+    def evict(self):
+        self._flush_touched()
+        # Sizes count shared content once per revision, so this errs towards evicting early
+        total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM revs').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes * 0.9
+        with self._conn:
+            self._conn.execute('BEGIN IMMEDIATE')
+            self._conn.execute("""
+                DELETE FROM revs WHERE revid IN (
+                    SELECT revid FROM (
+                        SELECT revid, size, SUM(size) OVER (ORDER BY atime, revid) AS total
+                        FROM revs
+                    ) WHERE total - size < ?
+                )
+            """, (excess,))
+            self._conn.execute(
+                'DELETE FROM blobs WHERE NOT EXISTS '
+                '(SELECT 1 FROM revs WHERE revs.hash = blobs.hash)')
+
+    def close(self):
+        self.evict()
+        self._conn.close()
+
+
+class CachedStore(RevisionStore):
+    # A case's store, falling back to the machine-wide revision cache for revisions it lacks.
+    # Revisions found in the cache are copied into the case, since what's built from it may
+    # refer to them by id and be read without the cache.
+    def __init__(self, store: RevisionStore, cache: RevisionCache):
+        self.store = store
+        self.cache = cache
+
+    def __contains__(self, revid: int) -> bool:
+        return revid in self.store or revid in self.cache
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.store)
+
+    def get(self, revid: int) -> dict:
+        try:
+            return self.store.get(revid)
+        except KeyError:
+            rev = self.cache.get(revid)
+        self.store.put(revid, rev)
+        return rev
+
+    def put_many(self, revs: Iterable[Tuple[int, dict]]):
+        revs = list(revs)
+        self.store.put_many(revs)
+        self.cache.put_many(revs)
+
+    def flush(self):
+        self.store.flush()
+
+    def close(self):
+        self.store.close()
+        self.cache.close()
+
+
+def open_cache(max_bytes: int) -> RevisionCache:
+    return RevisionCache(utils.cache_dir() / 'revisions.db', max_bytes)
+
+def open_store(root: Path, backend: Optional[str] = None) -> RevisionStore:
+    db_path = root / 'revs.db'
+    rev_dir = root / 'revs'
+    if backend is None:
+        backend = 'dir' if rev_dir.exists() and not db_path.exists() else 'sqlite'
+    if backend == 'sqlite':
+        return SQLiteStore(db_path)
+    if backend == 'dir':
+        rev_dir.mkdir(exist_ok=True)
+        return DirectoryStore(rev_dir)
+    raise NotImplementedError(backend)
+
+def migrate(src: RevisionStore, dst: RevisionStore, batch_size: int = 500):
+    revids = sorted(src)
+    for i in tqdm.tqdm(range(0, len(revids), batch_size), unit='batches'):
+        dst.put_many((revid, src.get(revid)) for revid in revids[i:i + batch_size])
+    dst.flush()
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate a case's revision files into revs.db")
+    parser.add_argument('case', help='Case dir')
+    args = parser.parse_args()
+    utils.setup_logging()
+
+    root = Path(args.case)
+    rev_dir = root / 'revs'
+    if not rev_dir.exists():
+        raise RuntimeError(f'Revision dir {rev_dir} does not exist')
+
+    logging.info('migrating revisions...')
+    with open_store(root, 'dir') as src, open_store(root, 'sqlite') as dst:
+        migrate(src, dst)
+    logging.info(f'done; {rev_dir} can now be removed')
+
+if __name__ == '__main__':
+    main()
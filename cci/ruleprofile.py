@@ -0,0 +1,103 @@
+from __future__ import annotations
+from array import array
+import dataclasses
+from dataclasses import dataclass
+import json
+import math
+from pathlib import Path
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .case import CullRule
+from .rules import Rule, RuleSet, Whitelist, enable_preprocess_timing, preprocess_seconds
+
+Matcher = Callable[[Rule], Optional[CullRule]]
+
+@dataclass
+class RuleStats:
+    evaluations: int = 0
+    hits: int = 0
+    # Lines the rule matched but couldn't cull because its max was reached
+    capped: int = 0
+    seconds: float = 0.0
+    pre_seconds: float = 0.0
+    times: array = dataclasses.field(default_factory=lambda: array('d'))
+
+    def add(self, elapsed: float, pre: float, hit: bool):
+        self.evaluations += 1
+        self.hits += hit
+        self.seconds += elapsed
+        self.pre_seconds += pre
+        self.times.append(elapsed)
+
+    def p99(self) -> float:
+        if not self.times:
+            return 0.0
+        return sorted(self.times)[math.ceil(len(self.times) * 0.99) - 1]
+
+    def dump(self) -> dict:
+        return {
+            'evaluations': self.evaluations,
+            'hits': self.hits,
+            'capped': self.capped,
+            'seconds': self.seconds,
+            'mean_seconds': self.seconds / self.evaluations if self.evaluations else 0.0,
+            'p99_seconds': self.p99(),
+            'pre_seconds': self.pre_seconds,
+        }
+
+
+class RuleProfiler:
+    # Times every whitelist application and rule evaluation made while culling
+    def __init__(self, rules: RuleSet):
+        self.whitelist = RuleStats()
+        self.rules: Dict[str, RuleStats] = {rule.name: RuleStats() for rule in rules.rules}
+        enable_preprocess_timing()
+
+    def apply_whitelist(
+        self, whitelist: Whitelist, text: str, debug: bool = False,
+    ) -> Tuple[str, List[str]]:
+        start = time.perf_counter()
+        text, items = whitelist.apply(text, debug)
+        self.whitelist.add(time.perf_counter() - start, 0.0, bool(items))
+        return text, items
+
+    def wrap(self, match: Matcher) -> Matcher:
+        def timed(rule: Rule) -> Optional[CullRule]:
+            pre = preprocess_seconds()
+            start = time.perf_counter()
+            result = match(rule)
+            elapsed = time.perf_counter() - start
+            self.rules[rule.name].add(elapsed, preprocess_seconds() - pre, result is not None)
+            return result
+        return timed
+
+    def capped(self, rule: Rule):
+        self.rules[rule.name].capped += 1
+
+    def dump(self) -> dict:
+        return {
+            'whitelist': self.whitelist.dump(),
+            'rules': {name: stats.dump() for name, stats in self.rules.items()},
+        }
+
+    def save(self, path: Path):
+        with path.open('w') as fp:
+            json.dump(self.dump(), fp, indent=2)
+            fp.write('\n')
+
+    def table(self) -> str:
+        rows = [('(whitelist)', self.whitelist)] + sorted(
+            self.rules.items(), key=lambda item: item[1].seconds, reverse=True)
+        lines = [
+            f"{'rule':<24} {'evals':>9} {'hits':>8} {'total s':>9} {'mean us':>9} "
+            f"{'p99 us':>9} {'pre s':>8} {'capped':>7}"
+        ]
+        for name, stats in rows:
+            mean = stats.seconds / stats.evaluations if stats.evaluations else 0.0
+            lines.append(
+                f'{name:<24} {stats.evaluations:>9} {stats.hits:>8} {stats.seconds:>9.3f} '
+                f'{mean * 1e6:>9.1f} {stats.p99() * 1e6:>9.1f} {stats.pre_seconds:>8.3f} '
+                f'{stats.capped:>7}'
+            )
+        return '\n'.join(lines)
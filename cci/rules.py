@@ -0,0 +1,482 @@
+from __future__ import annotations
+from dataclasses import dataclass
+import functools
+import hashlib
+import json
+import logging
+import operator
+from pathlib import Path
+import re
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+import sqlite3
+import time
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+import mwparserfromhell
+from mwparserfromhell.definitions import URI_SCHEMES
+import yaml
+
+from .ahocorasick import Automaton
+from .case import CullRule
+
+# Patterns that refer to their own groups can't be safely merged into one alternation
+_GROUP_REFERENCE = re.compile(r'\\[1-9]|\(\?P=|\(\?\(')
+# Anything that stripping could remove from the middle of a line, joining the text around it
+_MARKUP = re.compile(r"[{\[<]|''|(?:%s):|^[*#:;]*;" % '|'.join(URI_SCHEMES))
+# The non-ASCII letters that IGNORECASE matches against ASCII ones, mapped to those
+_FOLD = str.maketrans({'\u0130': 'i', '\u0131': 'i', '\u017f': 's', '\u212a': 'k'})
+
+# Text a line needs to contain for a rule to have any chance of matching it: every clause must
+# be satisfied by one of its alternatives. Alternatives are lowercase ASCII.
+Requires = List[FrozenSet[str]]
+
+@dataclass
+class Rule:
+    name: str
+    max: Optional[int]
+    # Changes whenever the rule's definition does
+    fingerprint: str
+
+    @classmethod
+    def load(cls, name: str, raw: dict) -> Rule:
+        if raw['type'] == 'regex':
+            return RegexRule.load(name, raw)
+        if raw['type'] == 'refs':
+            return RefsRule.load(name, raw)
+        raise NotImplementedError(raw['type'])
+
+    @staticmethod
+    def _fingerprint(name: str, raw: dict) -> str:
+        dump = json.dumps([name, raw], sort_keys=True, default=str)
+        return hashlib.sha1(dump.encode()).hexdigest()
+
+    def match(self, text: str, debug: bool = False) -> Optional[CullRule]:
+        raise NotImplementedError()
+
+
+@dataclass
+class RegexRule(Rule):
+    pre: Optional[str]
+    subs: List[Tuple[re.Pattern, str]]
+    patterns: List[Tuple[str, re.Pattern]]
+    combined: Optional[re.Pattern]
+    # Alternatives in requires have to occur as substrings, those in requires_chars only need
+    # all of their characters to
+    requires: Requires
+    requires_chars: Requires
+
+    @classmethod
+    def load(cls, name: str, raw: dict) -> RegexRule:
+        patterns = [raw['match']] if isinstance(raw['match'], str) else raw['match']
+        if 'flags' in raw:
+            raw_flags = [raw['flags']] if isinstance(raw['flags'], str) else raw['flags']
+            flags = functools.reduce(operator.or_, [re.RegexFlag[flag] for flag in raw_flags])
+        else:
+            flags = re.IGNORECASE
+        subs = raw.get('sub', [])
+        # pre and sub can remove text from the middle of a line, joining what was around it, so
+        # then only single characters that they can't add themselves are worth checking for
+        requires = _derive_requires(patterns, flags)
+        requires_chars = []
+        if raw.get('pre') or subs:
+            added = set(''.join(repl for _, repl in subs).lower())
+            requires, requires_chars = [], _split_requires(requires, added)
+        # Rules can also list what lines need to contain, if the patterns don't make it clear
+        requires += _declared_requires(raw.get('requires', []))
+        return cls(
+            name=name,
+            max=raw.get('max'),
+            fingerprint=cls._fingerprint(name, raw),
+            pre=raw.get('pre'),
+            subs=[(re.compile(pat), repl) for pat, repl in subs],
+            patterns=[(pattern, re.compile(pattern, flags)) for pattern in patterns],
+            combined=_combine_patterns(patterns, flags),
+            requires=requires,
+            requires_chars=requires_chars,
+        )
+
+    def match(self, text: str, debug: bool = False) -> Optional[CullRule]:
+        if (self.requires or self.requires_chars) and \
+                not _satisfies(self.requires, self.requires_chars, _fold(text)):
+            if debug:
+                logging.info(f'skip rule {self.name}: text {text!r} lacks what it requires')
+            return None
+        if self.pre:
+            text = _preprocess(self.pre, text)
+        for regex, repl in self.subs:
+            text = regex.sub(repl, text)
+        if self.combined and not debug:
+            match = self.combined.fullmatch(text)
+            if not match:
+                return None
+            pattern = self.patterns[int(match.lastgroup[1:])][0]
+            return CullRule(self.name, f'regex match: {pattern}')
+        for pattern, regex in self.patterns:
+            if debug:
+                logging.info(f'try pattern {pattern!r} against text {text!r}')
+            if regex.fullmatch(text):
+                return CullRule(self.name, f'regex match: {pattern}')
+        return None
+
+
+@dataclass
+class RefsRule(Rule):
+    journals: List[str]
+    titles: List[str]
+    journal_index: Automaton
+    title_index: Automaton
+
+    @classmethod
+    def load(cls, name: str, raw: dict) -> RefsRule:
+        return cls(
+            name=name,
+            max=raw.get('max'),
+            fingerprint=cls._fingerprint(name, raw),
+            journals=raw['journals'],
+            titles=raw['titles'],
+            journal_index=Automaton(raw['journals']),
+            title_index=Automaton(raw['titles']),
+        )
+
+    def match(self, text: str, debug: bool = False, threshold: int = 30) -> Optional[CullRule]:
+        if not text.startswith('*'):
+            return None
+        text = text.lower()
+        # Without markup, stripping can only drop the list prefix and squash whitespace, so the
+        # stripped text can't contain a journal that the raw text doesn't
+        if not _MARKUP.search(text) and not self.journal_index.find(re.sub(r'\s+', ' ', text)):
+            return None
+        text = _preprocess('strip', text)
+        journals = self.journal_index.find(text)
+        if not journals:
+            return None
+        titles = sorted(self.title_index.find(text))
+        for journal in sorted(journals):
+            journal = self.journals[journal]
+            for title in titles:
+                title = self.titles[title]
+                if len(text.replace(journal, '').replace(title, '')) < threshold:
+                    return CullRule(self.name, 'bibliography match')
+        return None
+
+
+@dataclass
+class Whitelist:
+    items: List[str]
+    automaton: Automaton
+
+    @classmethod
+    def load(cls, raw: str) -> Whitelist:
+        items = raw.splitlines()
+        return cls(items=items, automaton=Automaton(items))
+
+    def apply(self, text: str, debug: bool = False) -> Tuple[str, List[str]]:
+        # Remove every whitelisted item from the text, in whitelist order. Only items that occur
+        # in the text are checked; removing one can make a later item occur, so the text is
+        # searched again after each removal.
+        found = []
+        candidates = sorted(self.automaton.find(text))
+        while candidates:
+            index = candidates[0]
+            item = self.items[index]
+            if debug:
+                logging.info(f'whitelist match for {item!r} against text {text!r}')
+            text = text.replace(item, '')
+            found.append(item)
+            candidates = sorted(i for i in self.automaton.find(text) if i > index)
+        return text, found
+
+
+@dataclass
+class RuleSet:
+    rules: List[Rule]
+    whitelist: Whitelist
+
+    @classmethod
+    def load(cls, rules_path: Path) -> RuleSet:
+        with rules_path.open() as fp:
+            raw = yaml.load(fp, yaml.CSafeLoader)
+        return cls(
+            rules=[Rule.load(name, rule) for name, rule in raw['rules'].items()],
+            whitelist=Whitelist.load(raw.get('whitelist', '')),
+        )
+
+def _combine_patterns(patterns: List[str], flags: re.RegexFlag) -> Optional[re.Pattern]:
+    # Merge a rule's patterns into a single alternation with one named group per pattern, so a
+    # line can be tested in one call while still telling which pattern matched. fullmatch() tries
+    # the alternatives in order, so the first pattern to match wins as it would when looping.
+    if len(patterns) < 2 or any(_GROUP_REFERENCE.search(pattern) for pattern in patterns):
+        return None
+    end = '\n)' if flags & re.VERBOSE else ')'
+    combined = '|'.join(f'(?P<_{i}>{pattern}{end}' for i, pattern in enumerate(patterns))
+    try:
+        return re.compile(combined, flags)
+    except re.error:
+        return None
+
+def _declared_requires(raw: list) -> Requires:
+    # Each item is a string the line must contain, or a list of strings it must contain one of
+    return [frozenset(item.lower() for item in ([alts] if isinstance(alts, str) else alts))
+            for alts in raw]
+
+def _derive_requires(patterns: List[str], flags: re.RegexFlag) -> Requires:
+    # What every one of the patterns needs the text to contain, for fullmatch() to succeed
+    options = []
+    for pattern in patterns:
+        clauses = _required(sre_parse.parse(pattern, flags))
+        if not clauses:
+            return []
+        options.append(clauses)
+    if len(options) == 1:
+        return options[0]
+    # Any pattern can match, so only one clause of each can be asked for
+    return [frozenset().union(*(_best_clause(clauses) for clauses in options))]
+
+def _best_clause(clauses: Requires) -> FrozenSet[str]:
+    return max(clauses, key=lambda alts: (min(map(len, alts)), -len(alts)))
+
+# Only in Python 3.11 and later
+_ATOMIC_GROUP = getattr(sre_parse, 'ATOMIC_GROUP', None)
+_REPEATS = [sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT,
+            getattr(sre_parse, 'POSSESSIVE_REPEAT', None)]
+
+def _required(items) -> Requires:
+    clauses: Requires = []
+    run = ''
+
+    def flush():
+        nonlocal run
+        if run:
+            clauses.append(frozenset([run]))
+            run = ''
+
+    for op, av in items:
+        if op is sre_parse.LITERAL:
+            char = chr(av).lower()
+            if char.isascii():
+                run += char
+                continue
+            flush()
+            continue
+        flush()
+        if op is sre_parse.SUBPATTERN:
+            clauses += _required(av[-1])
+        elif op is _ATOMIC_GROUP:
+            clauses += _required(av)
+        elif op in _REPEATS:
+            if av[0] >= 1:
+                clauses += _required(av[2])
+        elif op is sre_parse.BRANCH:
+            alternatives = [_required(branch) for branch in av[1]]
+            if all(alternatives):
+                clauses.append(frozenset().union(*map(_best_clause, alternatives)))
+        elif op is sre_parse.IN:
+            chars = frozenset(chr(arg).lower() for kind, arg in av
+                              if kind is sre_parse.LITERAL)
+            # Only plain sets of literal characters, not ranges, categories or negations
+            if len(chars) == len(av) and all(char.isascii() for char in chars):
+                clauses.append(chars)
+    flush()
+    return clauses
+
+def _split_requires(requires: Requires, exclude: set) -> Requires:
+    # Turns alternatives into the characters they need, less whitespace and excluded ones
+    result = []
+    for alts in requires:
+        sets = {frozenset(char for char in alt if not char.isspace() and char not in exclude)
+                for alt in alts}
+        if not all(sets):
+            continue
+        # An alternative is redundant if a smaller one needs a subset of its characters
+        sets = {chars for chars in sets if not any(other < chars for other in sets)}
+        result.append(frozenset(''.join(sorted(chars)) for chars in sets))
+    return result
+
+@functools.lru_cache(maxsize=16)
+def _fold(text: str) -> str:
+    # Cached since every rule checks the same line in turn
+    return text.translate(_FOLD).lower()
+
+def _satisfies(requires: Requires, requires_chars: Requires, text: str) -> bool:
+    return all(any(alt in text for alt in alts) for alts in requires) and \
+        all(any(all(char in text for char in alt) for alt in alts) for alts in requires_chars)
+
+class PreprocessCache:
+    # Preprocessed text on disk, keyed by (mode, text hash), shared between runs and cases.
+    # Entries are evicted least recently used first once the file grows past max_bytes.
+    def __init__(self, path: Path, max_bytes: int, check_every: int = 1000):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.check_every = check_every
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        # Access times of hits, written together rather than an update per hit
+        self._touched: Dict[bytes, float] = {}
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key BLOB PRIMARY KEY, value TEXT, size INTEGER, atime REAL
+            )
+        """)
+        self._conn.execute('CREATE INDEX IF NOT EXISTS entries_atime ON entries (atime)')
+
+    @staticmethod
+    def _key(mode: str, text: str) -> bytes:
+        return hashlib.blake2b(f'{mode}\0{text}'.encode(), digest_size=16).digest()
+
+    def get(self, mode: str, text: str) -> Optional[str]:
+        key = self._key(mode, text)
+        row = self._conn.execute('SELECT value FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._touched[key] = time.time()
+        if len(self._touched) >= self.check_every:
+            self._flush_touched()
+        return row[0]
+
+    def put(self, mode: str, text: str, value: str):
+        self._conn.execute(
+            'INSERT OR REPLACE INTO entries (key, value, size, atime) VALUES (?, ?, ?, ?)',
+            (self._key(mode, text), value, len(text) + len(value) + 64, time.time()))
+        self._puts += 1
+        if self._puts % self.check_every == 0:
+            self.evict()
+
+    def _flush_touched(self):
+        if not self._touched:
+            return
+        with self._conn:
+            self._conn.execute('BEGIN IMMEDIATE')
+            self._conn.executemany('UPDATE entries SET atime = ? WHERE key = ?',
+                                   [(atime, key) for key, atime in self._touched.items()])
+        self._touched = {}
+
+    def evict(self):
+        self._flush_touched()
+        total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes * 0.9
+        self._conn.execute("""
+            DELETE FROM entries WHERE key IN (
+                SELECT key FROM (
+                    SELECT key, size, SUM(size) OVER (ORDER BY atime, key) AS total FROM entries
+                ) WHERE total - size < ?
+            )
+        """, (excess,))
+
+    def close(self):
+        self._flush_touched()
+        self._conn.close()
+
+_disk_cache: Optional[PreprocessCache] = None
+
+def configure_preprocess_cache(maxsize: int, disk_cache: Optional[PreprocessCache] = None):
+    global _preprocess_wikitext, _disk_cache
+    _preprocess_wikitext = functools.lru_cache(maxsize=maxsize)(_preprocess_wikitext_uncached)
+    _disk_cache = disk_cache
+
+def preprocess_cache_stats() -> str:
+    info = _preprocess_wikitext.cache_info()
+    stats = f'memory: {info.hits} hits, {info.misses} misses, {info.currsize} entries'
+    if _disk_cache:
+        stats += f'; disk: {_disk_cache.hits} hits, {_disk_cache.misses} misses'
+    return stats
+
+# Seconds spent preprocessing, only counted once enabled since timing every call isn't free
+_preprocess_seconds: Optional[float] = None
+
+def enable_preprocess_timing():
+    global _preprocess_seconds
+    if _preprocess_seconds is None:
+        _preprocess_seconds = 0.0
+
+def preprocess_seconds() -> float:
+    return _preprocess_seconds or 0.0
+
+def _preprocess(mode: str, text: str) -> str:
+    global _preprocess_seconds
+    if _preprocess_seconds is None:
+        return _preprocess_wikitext(mode, text)
+    start = time.perf_counter()
+    try:
+        return _preprocess_wikitext(mode, text)
+    finally:
+        _preprocess_seconds += time.perf_counter() - start
+
+def _preprocess_wikitext_uncached(mode: str, text: str) -> str:
+    if _disk_cache:
+        if (result := _disk_cache.get(mode, text)) is not None:
+            return result
+    result = _parse_and_preprocess(mode, text)
+    if _disk_cache:
+        _disk_cache.put(mode, text, result)
+    return result
+
+_preprocess_wikitext = functools.lru_cache(maxsize=100_000)(_preprocess_wikitext_uncached)
+
+def _parse_and_preprocess(mode: str, text: str) -> str:
+    tree = mwparserfromhell.parse(text)
+
+    if mode == 'strip':
+        _strip_links(tree)
+        _strip_tags(tree)
+    elif mode == 'deref':
+        for tag in tree.filter_tags():
+            if tag.tag == 'ref':
+                _strip_links(tree)
+        _strip_tags(tree)
+    elif mode == 'deextlink':
+        _strip_ext_links(tree)
+    else:
+        raise NotImplementedError(mode)
+
+    return re.sub(r'\s+', ' ', str(tree))
+
+def _strip_links(tree: mwparserfromhell.wikicode.Wikicode):
+    _strip_templates(tree)
+    _strip_wikilinks(tree)
+    _strip_ext_links(tree)
+
+def _strip_templates(tree: mwparserfromhell.wikicode.Wikicode, threshold: int = 30):
+    for template in tree.filter_templates(recursive=tree.RECURSE_OTHERS):
+        for param in reversed(template.params):
+            if len(param.name) < threshold and len(param.value) < threshold:
+                template.remove(param)
+        if not template.params and len(template.name) < threshold:
+            _tree_remove(tree, template)
+
+def _strip_wikilinks(tree: mwparserfromhell.wikicode.Wikicode, threshold: int = 50):
+    for link in tree.filter_wikilinks():
+        if len(link.title) < threshold and (link.text is None or len(link.text) < threshold):
+            _tree_remove(tree, link)
+
+def _strip_ext_links(tree: mwparserfromhell.wikicode.Wikicode,
+                     threshold: int = 250, url_threshold: int = 1000):
+    for link in tree.filter_external_links():
+        if len(link.url) < url_threshold and (link.title is None or len(link.title) < threshold):
+            _tree_remove(tree, link)
+
+def _strip_tags(tree: mwparserfromhell.wikicode.Wikicode, threshold: int = 200):
+    for tag in tree.filter_tags():
+        if tag.tag != 'ref' and not tag.attributes:
+            tree.replace(tag, tag.contents)
+
+    for tag in tree.filter_tags():
+        if tag.tag == 'ref' and len(tag.contents) < threshold:
+            _tree_remove(tree, tag)
+
+def _tree_remove(tree: mwparserfromhell.wikicode.Wikicode, node: mwparserfromhell.nodes.Node):
+    try:
+        tree.remove(node)
+    except ValueError:
+        pass
@@ -1,10 +1,17 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import logging
-from typing import Tuple
+import os
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Tuple, TypeVar
 
 from . import site
 
 CCI_PREFIX = 'Wikipedia:Contributor copyright investigations/'
 
+T = TypeVar('T')
+R = TypeVar('R')
+
 def setup_logging():
     logging.basicConfig(
         level=logging.INFO,
@@ -12,6 +19,10 @@ def setup_logging():
         datefmt='%Y-%m-%d %H:%M:%S',
     )
 
+def cache_dir() -> Path:
+    # Machine-wide caches shared between cases
+    return Path(os.environ.get('CCI_CACHE_DIR', '~/.cache/cci')).expanduser()
+
 def get_title_content(title: str) -> str:
     gen = site.query(
         titles=[title],
@@ -32,3 +43,18 @@ def get_title_revision(title: str) -> Tuple[int, str]:
     )
     rev = next(gen).pages[0].revisions[0]
     return (rev.revid, rev.slots.main.content)
+
+def parallel_map(func: Callable[[T], R], items: Iterable[T], jobs: int = 1) -> Iterator[R]:
+    # Like map(), but runs up to jobs calls at once in threads. Results are yielded in input order
+    # and items are consumed lazily, so at most a few results are held in memory at any time.
+    if jobs <= 1:
+        yield from map(func, items)
+        return
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = deque()
+        for item in items:
+            futures.append(executor.submit(func, item))
+            if len(futures) >= jobs * 2:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
@@ -52,7 +52,22 @@ function load(path) {
         return colors[val];
     }
 
-    const renderEdits = function(edits) {
+    const fetchData = function(url, compressed) {
+        return fetch(url).then(resp => {
+            if (!resp.ok) {
+                console.log('Error fetching diffs', resp);
+                throw new Error(`Error ${resp.status}`);
+            }
+            return compressed ? resp.arrayBuffer() : resp.text();
+        }).then(data => {
+            if (compressed) {
+                data = pako.inflate(new Uint8Array(data), {to: 'string'});
+            }
+            return JSON.parse(data);
+        });
+    };
+
+    const render = function(manifest, loadChunk) {
         const toc = document.createElement('ul');
         const tocItemTmpl = document.getElementById('toc-item-tmpl');
         const optionsTmpl = document.getElementById('options-tmpl');
@@ -66,107 +81,173 @@ function load(path) {
         main.append(toc);
 
         main.append(optionsTmpl.content.cloneNode(true));
+        const showCulled = document.getElementById('show-culled');
+        const showLive = document.getElementById('show-live');
+
+        const sentinel = document.createElement('div');
+        sentinel.textContent = 'Loading...';
+        main.append(sentinel);
 
         let curSecName = null, curSecElem = null, sectionCtr = 1;
         let curPageName = null, curPageElem = null;
 
-        edits.forEach(edit => {
-            if (curSecName !== edit.section) {
-                curSecElem = sectionTmpl.content.cloneNode(true).children[0];
-                const head = curSecElem.querySelector('h2');
-                head.id = `section-${sectionCtr}`;
-                head.textContent = edit.section;
-                head.prepend(addCollapsor());
-                main.append(curSecElem);
-                curSecName = edit.section;
-                sectionCtr++;
+        const renderEdits = function(edits) {
+            edits.forEach(edit => {
+                if (curSecName !== edit.section) {
+                    curSecElem = sectionTmpl.content.cloneNode(true).children[0];
+                    const head = curSecElem.querySelector('h2');
+                    head.id = `section-${sectionCtr}`;
+                    head.textContent = edit.section;
+                    head.prepend(addCollapsor());
+                    main.insertBefore(curSecElem, sentinel);
+                    curSecName = edit.section;
+                    curPageName = null;
+                    sectionCtr++;
+                }
 
-                const li = tocItemTmpl.content.cloneNode(true).children[0];
-                li.querySelector('a').href = `#section-${sectionCtr}`;
-                li.querySelector('a').textContent = edit.section;
-                toc.append(li);
-            }
+                if (curPageName !== edit.page) {
+                    curPageElem = pageTmpl.content.cloneNode(true).children[0];
+                    curPageElem.querySelector('a').href += edit.page.replaceAll(' ', '_');
+                    curPageElem.querySelector('a').textContent = edit.page;
+                    curPageElem.querySelector('h3').prepend(addCollapsor());
+                    curSecElem.append(curPageElem);
+                    curPageName = edit.page;
+                }
 
-            if (curPageName !== edit.page) {
-                curPageElem = pageTmpl.content.cloneNode(true).children[0];
-                curPageElem.querySelector('a').href += edit.page.replaceAll(' ', '_');
-                curPageElem.querySelector('a').textContent = edit.page;
-                curPageElem.querySelector('h3').prepend(addCollapsor());
-                curSecElem.append(curPageElem);
-                curPageName = edit.page;
-            }
+                const item = editTmpl.content.cloneNode(true).children[0];
+                item.querySelector('h4 a').href += edit.diff;
+                item.querySelector('h4 a').textContent = edit.diff;
+                item.querySelector('h4').prepend(addCollapsor());
+
+                const table = item.querySelector('table');
+                edit.lines.forEach(line => {
+                    const row = lineTmpl.content.cloneNode(true).children[0];
+                    row.querySelector('.line-index').textContent = line.index;
+                    const lineStatus = row.querySelector('.line-status');
+                    lineStatus.textContent = line.culled ? 'autocull' : 'live';
+                    lineStatus.classList.add(lineStatus.textContent);
+                    row.querySelector('.line-text').textContent = line.text;
+                    row.querySelector('.line-text').classList.add(lineStatus.textContent);
+                    line.rules.forEach(rule => {
+                        let it;
+                        if (rule.detail) {
+                            it = document.createElement('abbr');
+                            it.title = rule.detail;
+                        } else {
+                            it = document.createElement('span');
+                        }
+                        it.textContent = rule.name;
+                        it.style.backgroundColor = makeColor(rule.name);
+                        row.querySelector('.line-rules').append(it);
+                    });
+                    row.hidden = !(line.culled ? showCulled.checked : showLive.checked);
+                    table.append(row);
+                });
+                curPageElem.append(item);
+            });
+        };
 
-            const item = editTmpl.content.cloneNode(true).children[0];
-            item.querySelector('h4 a').href += edit.diff;
-            item.querySelector('h4 a').textContent = edit.diff;
-            item.querySelector('h4').prepend(addCollapsor());
-
-            const table = item.querySelector('table');
-            edit.delta.lines.forEach(line => {
-                const row = lineTmpl.content.cloneNode(true).children[0];
-                row.querySelector('.line-index').textContent = line.index;
-                const lineStatus = row.querySelector('.line-status');
-                lineStatus.textContent = line.culled ? 'autocull' : 'live';
-                lineStatus.classList.add(lineStatus.textContent);
-                row.querySelector('.line-text').textContent = line.text;
-                row.querySelector('.line-text').classList.add(lineStatus.textContent);
-                line.rules.forEach(rule => {
-                    let it;
-                    if (rule.detail) {
-                        it = document.createElement('abbr');
-                        it.title = rule.detail;
+        // Chunks are loaded in order, as the end of the page scrolls into view
+        let nextChunk = 0, pending = null;
+        const observer = new IntersectionObserver(entries => {
+            if (entries.some(entry => entry.isIntersecting)) {
+                loadNext();
+            }
+        }, {rootMargin: '2000px'});
+
+        const loadNext = function() {
+            if (pending === null && nextChunk < manifest.chunks.length) {
+                pending = loadChunk(nextChunk).then(edits => {
+                    renderEdits(edits);
+                    nextChunk++;
+                    pending = null;
+                    observer.unobserve(sentinel);
+                    if (nextChunk < manifest.chunks.length) {
+                        // Re-observing fires again if the sentinel is still in view
+                        observer.observe(sentinel);
                     } else {
-                        it = document.createElement('span');
+                        sentinel.remove();
                     }
-                    it.textContent = rule.name;
-                    it.style.backgroundColor = makeColor(rule.name);
-                    row.querySelector('.line-rules').append(it);
+                }, err => {
+                    pending = null;
+                    observer.disconnect();
+                    sentinel.classList.add('error');
+                    sentinel.textContent = `Could not load diffs! ${err}`;
+                    throw err;
                 });
-                table.append(row);
+            }
+            return pending;
+        };
+
+        const loadUntil = function(chunk) {
+            if (nextChunk > chunk) {
+                return Promise.resolve();
+            }
+            return loadNext().then(() => loadUntil(chunk));
+        };
+
+        let tocCtr = 1, lastSection = null;
+        manifest.chunks.forEach((chunk, index) => {
+            chunk.sections.forEach(section => {
+                if (section === lastSection) {
+                    return;
+                }
+                const id = `section-${tocCtr}`;
+                const li = tocItemTmpl.content.cloneNode(true).children[0];
+                li.querySelector('a').href = `#${id}`;
+                li.querySelector('a').textContent = section;
+                li.querySelector('a').addEventListener('click', e => {
+                    e.preventDefault();
+                    loadUntil(index).then(() => {
+                        document.getElementById(id).scrollIntoView();
+                        history.replaceState(null, '', `#${id}`);
+                    }, () => {});
+                });
+                toc.append(li);
+                lastSection = section;
+                tocCtr++;
             });
-            curPageElem.append(item);
         });
 
-        document.getElementById('show-culled').addEventListener('change', e => {
+        showCulled.addEventListener('change', e => {
             setFilter('autocull', e.currentTarget.checked);
         });
-        document.getElementById('show-live').addEventListener('change', e => {
+        showLive.addEventListener('change', e => {
             setFilter('live', e.currentTarget.checked);
         });
 
         const urlParams = new URLSearchParams(window.location.search);
         if (urlParams.get('culled') === '0') {
-            document.getElementById('show-culled').checked = false;
-            setFilter('autocull', false);
+            showCulled.checked = false;
         }
         if (urlParams.get('live') === '0') {
-            document.getElementById('show-live').checked = false;
-            setFilter('live', false);
+            showLive.checked = false;
         }
-    };
 
-    fetch(path).then(resp => {
-        if (!resp.ok) {
-            console.log('Error fetching diffs', resp);
-            setErr(`Could not load diffs! Error ${resp.status}`);
-            return;
+        if (manifest.chunks.length) {
+            observer.observe(sentinel);
+        } else {
+            sentinel.remove();
         }
-        return resp.arrayBuffer();
-    }).then(buff => {
-        let raw, edits;
-        const compressed = new Uint8Array(buff);
-        try {
-            raw = pako.inflate(compressed, {to: 'string'});
-        } catch (err) {
-            setErr(`Could not decompress diffs! ${err}`);
-            return;
-        }
-        try {
-            edits = JSON.parse(raw);
-        } catch (err) {
-            setErr(`Could not parse diffs! ${err}`);
-            return;
-        }
-        renderEdits(edits);
-    });
+    };
+
+    if (path.endsWith('.json.gz')) {
+        // Pages generated before chunked views existed point at the full cull file
+        fetchData(path, true).then(edits => {
+            edits = edits.map(edit => Object.assign(
+                {lines: edit.delta ? edit.delta.lines : []}, edit));
+            const sections = [];
+            edits.forEach(edit => {
+                if (sections[sections.length - 1] !== edit.section) {
+                    sections.push(edit.section);
+                }
+            });
+            render({chunks: [{sections: sections}]}, () => Promise.resolve(edits));
+        }, err => setErr(`Could not load diffs! ${err}`));
+    } else {
+        const base = path.substring(0, path.lastIndexOf('/') + 1);
+        fetchData(path, false).then(manifest => {
+            render(manifest, i => fetchData(base + manifest.chunks[i].path, true));
+        }, err => setErr(`Could not load diffs! ${err}`));
+    }
 }